@@ -0,0 +1,5 @@
+"""
+Offline benchmarks of rendition lookup, generation and tag rendering.
+
+Run from the project root with ``python -m benchmarks.run``, see ``--help`` for options.
+"""
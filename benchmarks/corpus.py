@@ -0,0 +1,77 @@
+import random
+from io import BytesIO
+
+from django.core.files.images import ImageFile
+from PIL import Image as PILImage
+from PIL import ImageDraw
+
+from wagtail.images import get_image_model
+
+
+# name, width, height, format, mode
+CORPUS = [
+    ('landscape-jpeg', 3000, 2000, 'JPEG', 'RGB'),
+    ('portrait-jpeg', 1500, 2250, 'JPEG', 'RGB'),
+    ('large-jpeg', 6000, 4000, 'JPEG', 'RGB'),
+    ('opaque-png', 1600, 1200, 'PNG', 'RGB'),
+    ('alpha-png', 1600, 1200, 'PNG', 'RGBA'),
+    ('alpha-webp', 1200, 800, 'WEBP', 'RGBA'),
+    ('small-gif', 400, 300, 'GIF', 'P'),
+]
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'GIF': 'gif',
+}
+
+
+def draw_image(width, height, mode, seed):
+    """
+    Deterministic picture with gradients and shapes, so encoders have realistic detail to work on.
+    """
+    rng = random.Random(seed)
+    gradient = PILImage.linear_gradient('L').resize((width, height))
+    radial = PILImage.radial_gradient('L').resize((width, height))
+    image = PILImage.merge('RGB', (gradient, radial, gradient.transpose(PILImage.FLIP_LEFT_RIGHT)))
+
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.randrange(4, max(5, min(width, height) // 6))
+        colour = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.ellipse((x, y, x + size, y + size), fill=colour)
+        else:
+            draw.line((x, y, x + size, y + rng.randrange(-size, size)), fill=colour, width=rng.randrange(1, 6))
+
+    if mode == 'RGBA':
+        image.putalpha(radial)
+    elif mode == 'P':
+        image = image.convert('P', palette=PILImage.ADAPTIVE)
+    return image
+
+
+def make_image_file(name, width, height, format, mode, seed=0):
+    f = BytesIO()
+    draw_image(width, height, mode, seed=f"{name}-{seed}").save(f, format)
+    f.seek(0)
+    return ImageFile(f, name=f"{name}.{EXTENSIONS[format]}")
+
+
+def build_corpus(corpus=CORPUS):
+    """
+    Create one image per corpus entry, with a focal point off-centre so fill filters crop around it.
+    """
+    Image = get_image_model()
+    images = []
+    for name, width, height, format, mode in corpus:
+        image = Image(title=name, file=make_image_file(name, width, height, format, mode))
+        image.focal_point_x = width // 3
+        image.focal_point_y = height // 3
+        image.focal_point_width = width // 5
+        image.focal_point_height = height // 5
+        image.save()
+        images.append(image)
+    return images
@@ -0,0 +1,188 @@
+"""
+Concurrent renders of the demo home page, as when many visitors hit a freshly deployed page at once.
+
+Run from the project root with ``python -m benchmarks.load``.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import django
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.files.storage import FileSystemStorage  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from wagtail.images import get_image_model  # noqa: E402
+
+from benchmarks.corpus import build_corpus  # noqa: E402
+from benchmarks.measure import MemorySampler  # noqa: E402
+from benchmarks.run import clear_caches, delete_renditions, format_value  # noqa: E402
+from benchmarks.storage import RemoteStorage  # noqa: E402
+from home.models import HomePage  # noqa: E402
+
+
+CORPUS = [
+    ('home-jpeg', 3000, 2000, 'JPEG', 'RGB'),
+]
+
+
+class SaveCountingStorage(FileSystemStorage):
+    """
+    Counts the files saved under each name, so the same rendition generated by several requests shows up.
+    Duplicates are saved with a suffix, or deleted once they lose the database conflict.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saves = Counter()
+        self._lock = threading.Lock()
+
+    def save(self, name, content, max_length=None):
+        with self._lock:
+            self.saves[name] += 1
+        return super().save(name, content, max_length)
+
+    def reset(self):
+        with self._lock:
+            self.saves.clear()
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.saves.values())
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a non-empty list.
+    """
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))]
+
+
+def run_load(url, threads, requests):
+    """
+    Start all threads at once, each getting the page ``requests`` times in a row.
+
+    :return: (latencies in seconds, number of errors, wall time in seconds)
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        # One client per thread, as clients keep per-session state.
+        client = Client(raise_request_exception=False)
+        barrier.wait()
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = client.get(url)
+                duration = time.perf_counter() - start
+                with lock:
+                    latencies.append(duration)
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - start
+
+
+def get_scenarios(url, originals_cache_dir):
+    """
+    Each scenario is measured from a state: no renditions at all, as for a new deployment (cold-storage),
+    renditions in the database and storage but empty caches (cold-cache), and renditions cached (warm-cache).
+    Returns a list of (name, setup).
+    """
+    def cold_storage():
+        delete_renditions()
+        if originals_cache_dir:
+            shutil.rmtree(originals_cache_dir, ignore_errors=True)
+
+    def warm_cache():
+        Client().get(url)
+
+    return [
+        ('cold-storage', cold_storage),
+        ('cold-cache', clear_caches),
+        ('warm-cache', warm_cache),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the demo home page from many threads at once.")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=4, help="Requests per thread")
+    parser.add_argument('--only', action='append', default=[], help="Only run scenarios containing this text")
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help="Seconds to open an original image, read from a fake remote storage if set",
+    )
+    options = parser.parse_args(argv)
+
+    rendition_storage = SaveCountingStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL)
+    get_image_model().get_rendition_model()._meta.get_field('file').storage = rendition_storage
+    originals_cache_dir = None
+    if options.latency:
+        image_storage = RemoteStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL, latency=options.latency)
+        get_image_model()._meta.get_field('file').storage = image_storage
+        originals_cache_dir = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_DIR', None)
+
+    call_command('migrate', verbosity=0, interactive=False)
+    image, = build_corpus(CORPUS)
+    page = HomePage.objects.get(slug='home')
+    page.test_image = image
+    page.save()
+    url = page.url
+
+    print(f"{options.threads} threads, {options.requests} requests each, GET {url}")
+    for name, setup in get_scenarios(url, originals_cache_dir):
+        if options.only and not any(text in name for text in options.only):
+            continue
+        setup()
+        rendition_storage.reset()
+        with MemorySampler() as memory:
+            latencies, errors, wall_time = run_load(url, options.threads, options.requests)
+
+        print(
+            f"{name}: {len(latencies) / wall_time:.1f} requests/s, "
+            f"p50 {percentile(latencies, 50) * 1000:.0f}ms, "
+            f"p95 {percentile(latencies, 95) * 1000:.0f}ms, "
+            f"p99 {percentile(latencies, 99) * 1000:.0f}ms, "
+            f"max {max(latencies) * 1000:.0f}ms, "
+            f"mean {statistics.mean(latencies) * 1000:.0f}ms, "
+            f"renditions saved {sum(rendition_storage.saves.values())}, "
+            f"duplicates {rendition_storage.duplicates}, "
+            f"peak_memory {format_value('peak_memory', memory.peak_increase)}, "
+            f"errors {errors}"
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    finally:
+        if not os.environ.get('WAGTAIL_PICTURE_PROPOSAL_BENCHMARK_DIR'):
+            shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+    sys.exit(status)
@@ -0,0 +1,123 @@
+import os
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def get_rss():
+    """
+    Resident set size of the process in bytes, or None where /proc isn't available.
+    Unlike tracemalloc, this also covers the pixel buffers allocated by Pillow.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class MemorySampler:
+    """
+    Samples the resident set size in a background thread, to find the peak reached while running some code.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = get_rss()
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.sample()
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, get_rss())
+
+    @property
+    def peak_increase(self):
+        if self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+
+def get_media_size():
+    total = 0
+    for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def measure(run, setup=None, repeat=3):
+    """
+    Time ``run`` over several repetitions, calling ``setup`` before each one to reset the state.
+    Returns wall times (min and median, in seconds), and from the last repetition
+    the number of queries, the peak memory increase and the bytes written to media storage.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        media_size = get_media_size()
+        with CaptureQueriesContext(connection) as queries, MemorySampler() as memory:
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+    return {
+        'time_min': min(times),
+        'time_median': statistics.median(times),
+        'queries': len(queries),
+        'peak_memory': memory.peak_increase,
+        'bytes_written': get_media_size() - media_size,
+    }
+
+
+# Metrics compared against the baseline, with the absolute change below which measured metrics count as noise.
+# Counted metrics (None) are exact.
+COMPARED_METRICS = {
+    'time_median': 0.001,
+    'queries': None,
+    'peak_memory': 1024 * 1024,
+    'bytes_written': None,
+}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results to a baseline run. Measured metrics regress if they grow by more than ``threshold``
+    (a ratio), counted metrics if they grow at all.
+    Returns a list of (scenario, metric, baseline value, new value, regressed).
+    """
+    comparisons = []
+    for scenario, metrics in results.items():
+        if scenario not in baseline:
+            continue
+        for metric, noise in COMPARED_METRICS.items():
+            old, new = baseline[scenario].get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            if noise is None:
+                regressed = new > old
+            else:
+                regressed = new > old * (1 + threshold) and new - old > noise
+            comparisons.append((scenario, metric, old, new, regressed))
+    return comparisons
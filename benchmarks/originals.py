@@ -0,0 +1,107 @@
+"""
+Reads of original images from (fake) remote storage when generating renditions,
+with and without the local originals cache.
+
+Run from the project root with ``python -m benchmarks.originals``.
+"""
+import argparse
+import os
+import shutil
+import sys
+import threading
+import time
+
+import django
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from wagtail.images import get_image_model  # noqa: E402
+
+from benchmarks.corpus import build_corpus  # noqa: E402
+from benchmarks.storage import RemoteStorage  # noqa: E402
+from wagtail_picture_proposal.shortcuts import image_get_renditions  # noqa: E402
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters  # noqa: E402
+
+
+# Each batch is a new set of specs for every image, as when templates start using a new size.
+SPEC_BATCHES = [
+    "width-{320,640}",
+    "width-{480,960}",
+    "fill-{200x200,400x400}",
+    "max-{300x300,600x600}",
+]
+
+CORPUS = [
+    ('landscape-jpeg', 3000, 2000, 'JPEG', 'RGB'),
+    ('alpha-png', 1600, 1200, 'PNG', 'RGBA'),
+]
+
+
+def delete_renditions():
+    get_image_model().get_rendition_model().objects.all().delete()
+
+
+def generate_batches(images):
+    for specs in SPEC_BATCHES:
+        filters = compile_filters(compile_filter_specs((specs,)))
+        for image in images:
+            image_get_renditions(image, filters)
+
+
+def generate_concurrently(image, threads):
+    """
+    Each thread generates different renditions of the same image at the same time.
+    """
+    def run(width):
+        image_get_renditions(image, compile_filters(compile_filter_specs((f"width-{width}",))))
+
+    workers = [threading.Thread(target=run, args=(100 + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count reads of remote originals when generating renditions.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds to open a file from the fake remote storage")
+    parser.add_argument('--threads', type=int, default=8)
+    options = parser.parse_args(argv)
+
+    storage = RemoteStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL, latency=options.latency)
+    get_image_model()._meta.get_field('file').storage = storage
+
+    call_command('migrate', verbosity=0, interactive=False)
+    images = build_corpus(CORPUS)
+    # Start from images fetched from the database, with closed files.
+    images = list(get_image_model().objects.filter(pk__in=[image.pk for image in images]))
+
+    for label, cache_dir in (('no cache', None), ('originals cache', os.path.join(settings.BENCHMARK_DIR, 'originals'))):
+        with override_settings(WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_DIR=cache_dir):
+            for name, run in (
+                ('batches', lambda: generate_batches(images)),
+                ('concurrent', lambda: generate_concurrently(images[0], options.threads)),
+            ):
+                delete_renditions()
+                if cache_dir:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                storage.reads = 0
+                start = time.perf_counter()
+                run()
+                print(f"{label}/{name}: {storage.reads} reads, {(time.perf_counter() - start) * 1000:.0f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    finally:
+        if not os.environ.get('WAGTAIL_PICTURE_PROPOSAL_BENCHMARK_DIR'):
+            shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+    sys.exit(status)
@@ -0,0 +1,187 @@
+"""
+Differential check of rendition predictions: generates renditions of a corpus of images for many filter specs,
+and compares their actual dimensions, format and file name to the predicted ones.
+Renditions decoded at a reduced size when generated on their own are also compared pixel by pixel
+to the output of Wagtail’s ``Filter.run``.
+
+Run from the project root with ``python -m benchmarks.predictions``.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+from io import BytesIO
+
+import django
+from PIL import Image as PILImage
+from PIL import ImageChops, ImageStat
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+
+from benchmarks.corpus import build_corpus  # noqa: E402
+from wagtail_picture_proposal.cache import get_file_format  # noqa: E402
+from wagtail_picture_proposal.predictions import predict_rendition_name  # noqa: E402
+from wagtail_picture_proposal.processing import (  # noqa: E402
+    generate_renditions,
+    get_decode_scale,
+    get_output_format,
+    group_filters,
+    predict_size,
+)
+from wagtail_picture_proposal.shortcuts import image_get_renditions  # noqa: E402
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters  # noqa: E402
+
+
+SPECS = (
+    "original",
+    "width-{1,320,333,1000,5000}",
+    "height-{1,240,517,1000}",
+    "max-{320x240,333x777,5000x5000}",
+    "min-{320x240,777x333,1500x1000}",
+    "fill-{100x100,300x200,320x1000,1000x320,5000x5000}",
+    "fill-{300x200,777x333}-c{0,50,100}",
+    "scale-{10,33,50,100,200}",
+    "width-640|bgcolor-fff",
+    "bgcolor-fff|fill-{200x200,300x100}",
+    "bgcolor-fff|fill-200x200-c100",
+    "bgcolor-fff|width-300",
+    "fill-200x200|format-webp",
+    "max-500x500|format-jpeg|jpegquality-60",
+)
+
+# Each format, with odd dimensions to check rounding.
+CORPUS = [
+    ('odd-jpeg', 997, 1333, 'JPEG', 'RGB'),
+    ('landscape-jpeg', 1200, 800, 'JPEG', 'RGB'),
+    ('large-jpeg', 4000, 3000, 'JPEG', 'RGB'),
+    ('alpha-png', 640, 481, 'PNG', 'RGBA'),
+    ('thin-png', 600, 61, 'PNG', 'RGB'),
+    ('tiny-png', 7, 5, 'PNG', 'RGBA'),
+    ('alpha-webp', 801, 599, 'WEBP', 'RGBA'),
+    ('small-gif', 401, 299, 'GIF', 'P'),
+]
+
+# Mean difference of a channel, out of 255, allowed between a rendition and the output of ``Filter.run``.
+PIXEL_TOLERANCE = 8
+# Renditions narrower or shorter than this are skipped, as resampling a reduced decode shifts their few pixels.
+PIXEL_MIN_SIZE = 16
+
+
+def randomise_focal_points(images, seed):
+    """
+    Move the focal points around, including to the edges and none at all.
+    """
+    rng = random.Random(seed)
+    for image in images:
+        if rng.random() < 0.2:
+            image.focal_point_x = image.focal_point_y = image.focal_point_width = image.focal_point_height = None
+        else:
+            image.focal_point_width = rng.randint(1, image.width)
+            image.focal_point_height = rng.randint(1, image.height)
+            image.focal_point_x = rng.choice([0, image.width, rng.randint(0, image.width)])
+            image.focal_point_y = rng.choice([0, image.height, rng.randint(0, image.height)])
+        image.save()
+
+
+def check_image(image, filters):
+    """
+    Returns a list of (spec, attribute, predicted, actual) for mismatching predictions.
+    """
+    predictions = [
+        (predict_size(image, filter), get_output_format(image, filter), predict_rendition_name(image, filter))
+        for filter in filters
+    ]
+    renditions = image_get_renditions(image, filters)
+
+    mismatches = []
+    for filter, (size, format, name), rendition in zip(filters, predictions, renditions):
+        for attribute, predicted, actual in (
+            ('size', size, (rendition.width, rendition.height)),
+            ('format', format, get_file_format(rendition.file.name)),
+            ('name', name, rendition.file.name),
+        ):
+            if predicted != actual:
+                mismatches.append((filter.spec, attribute, predicted, actual))
+    return mismatches
+
+
+def get_pixel_difference(generated_image, expected_image):
+    """
+    Largest mean difference of a channel between two generated images, out of 255.
+    """
+    generated = PILImage.open(BytesIO(generated_image.f.getvalue())).convert('RGBA')
+    expected = PILImage.open(BytesIO(expected_image.f.getvalue())).convert('RGBA')
+    return max(ImageStat.Stat(ImageChops.difference(generated, expected)).mean)
+
+
+def check_pixels(image, filters):
+    """
+    Returns a list of (spec, attribute, predicted, actual) for renditions whose pixels differ from ``Filter.run``,
+    beyond the resampling differences of a reduced decode. Renditions decoded at full size run the same
+    operations as ``Filter.run``, and are skipped.
+    """
+    mismatches = []
+    for filter in filters:
+        size = predict_size(image, filter)
+        if size is None or min(size) < PIXEL_MIN_SIZE:
+            continue
+        if get_decode_scale(image, group_filters([filter]), (image.width, image.height)) == 1:
+            continue
+
+        generated_image, = generate_renditions(image, [filter])
+        expected_image = filter.run(image, BytesIO())
+        if generated_image.get_size() != expected_image.get_size():
+            mismatches.append((filter.spec, 'pixel size', expected_image.get_size(), generated_image.get_size()))
+            continue
+        difference = get_pixel_difference(generated_image, expected_image)
+        if difference > PIXEL_TOLERANCE:
+            mismatches.append((filter.spec, 'pixel difference', f"<= {PIXEL_TOLERANCE}", round(difference, 1)))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare predicted renditions to generated ones.")
+    parser.add_argument('--rounds', type=int, default=3, help="Rounds of random focal points")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-pixels', dest='pixels', action='store_false', help="Skip comparing pixels to Filter.run",
+    )
+    options = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0, interactive=False)
+    images = build_corpus(CORPUS)
+    filters = [filter for spec in SPECS for filter in compile_filters(compile_filter_specs((spec,)))]
+
+    checked = failed = 0
+    for round in range(options.rounds):
+        if round:
+            randomise_focal_points(images, seed=f"{options.seed}-{round}")
+        for image in images:
+            mismatches = check_image(image, filters)
+            if options.pixels:
+                mismatches += check_pixels(image, filters)
+            checked += len(filters)
+            failed += len({spec for spec, *_ in mismatches})
+            for spec, attribute, predicted, actual in mismatches:
+                print(
+                    f"{image.title} ({image.width}x{image.height}, focal point {image.get_focal_point()}) "
+                    f"{spec}: predicted {attribute} {predicted}, got {actual}"
+                )
+
+    print(f"{checked} renditions checked, {failed} mispredicted")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    finally:
+        if not os.environ.get('WAGTAIL_PICTURE_PROPOSAL_BENCHMARK_DIR'):
+            shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+    sys.exit(status)
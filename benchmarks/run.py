@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+
+import django
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+django.setup()
+
+import PIL  # noqa: E402
+import wagtail  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.core.cache import caches  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.template import Context, Template  # noqa: E402
+
+from wagtail.images import get_image_model  # noqa: E402
+
+from benchmarks.corpus import build_corpus  # noqa: E402
+from benchmarks.measure import compare, measure  # noqa: E402
+from wagtail_picture_proposal.cache import get_fragment_cache, get_rendition_lru  # noqa: E402
+from wagtail_picture_proposal.shortcuts import image_get_renditions  # noqa: E402
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters  # noqa: E402
+
+
+SPECS = "width-{320,480,640,800,1024,1280,1600}"
+
+# Hundreds of specs for the same image, to check lookups scale with the number of specs.
+MANY_SPECS = "width-{%s}" % ",".join(str(width) for width in range(10, 410, 2))
+
+TEMPLATES = {
+    'img_srcset': (
+        "{% load wagtailpictureproposal_tags %}"
+        "{% img_srcset_wip image width-{320,480,640,800,1024,1280,1600} sizes=\"100vw\" alt=\"\" %}"
+    ),
+    'webp_picture': (
+        "{% load wagtailpictureproposal_tags %}"
+        "{% webp_picture_wip image width-{320,480,640,800,1024,1280,1600} q-80 sizes=\"100vw\" alt=\"\" %}"
+    ),
+}
+
+
+def clear_caches():
+    caches['renditions'].clear()
+    lru = get_rendition_lru()
+    if lru is not None:
+        lru.clear()
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is not None:
+        fragment_cache.clear()
+
+
+def delete_renditions():
+    get_image_model().get_rendition_model().objects.all().delete()
+    clear_caches()
+
+
+def get_targets(images):
+    """
+    Code paths to benchmark, as functions processing the whole corpus.
+    """
+    filters = compile_filters(compile_filter_specs((SPECS,)))
+
+    def get_renditions():
+        for image in images:
+            image_get_renditions(image, filters)
+
+    def render_template(template):
+        def render():
+            for image in images:
+                template.render(Context({'image': image}))
+        return render
+
+    targets = {'image_get_renditions': get_renditions}
+    for name, source in TEMPLATES.items():
+        targets[name] = render_template(Template(source))
+    return targets
+
+
+def get_many_specs_target(images):
+    """
+    Lookup of MANY_SPECS for the smallest image of the corpus, which keeps generating them cheap.
+    """
+    filters = compile_filters(compile_filter_specs((MANY_SPECS,)))
+    image = min(images, key=lambda image: image.width * image.height)
+
+    def get_renditions():
+        image_get_renditions(image, filters)
+    return get_renditions
+
+
+def get_scenarios(images):
+    """
+    Each target is measured from three states: no renditions (cold),
+    renditions in the database only (warm-db), and renditions in the caches (warm-cache).
+    Returns a list of (name, run, setup, warm up).
+    """
+    scenarios = []
+    for name, run in get_targets(images).items():
+        scenarios.append((f"{name}/cold", run, delete_renditions, None))
+        scenarios.append((f"{name}/warm-db", run, clear_caches, run))
+        scenarios.append((f"{name}/warm-cache", run, None, run))
+
+    run = get_many_specs_target(images)
+    scenarios.append(("image_get_renditions/many-specs/warm-db", run, clear_caches, run))
+    scenarios.append(("image_get_renditions/many-specs/warm-cache", run, None, run))
+    return scenarios
+
+
+def format_value(metric, value):
+    if value is None:
+        return "-"
+    if metric.startswith('time'):
+        return f"{value * 1000:.1f}ms"
+    if metric in ('peak_memory', 'bytes_written'):
+        return f"{value / 1024:.0f}KiB"
+    return str(value)
+
+
+def get_environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'wagtail': wagtail.__version__,
+        'pillow': PIL.__version__,
+        'machine': platform.machine(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rendition lookup, generation and tag rendering.")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions of each scenario")
+    parser.add_argument('--only', action='append', default=[], help="Only run scenarios containing this text")
+    parser.add_argument('--save', metavar='PATH', help="Save results as a baseline")
+    parser.add_argument('--baseline', metavar='PATH', help="Compare results against a saved baseline")
+    parser.add_argument(
+        '--threshold', type=float, default=0.25,
+        help="Relative increase of measured metrics (time, memory) reported as a regression",
+    )
+    options = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0, interactive=False)
+    images = build_corpus()
+
+    results = {}
+    for name, run, setup, warm_up in get_scenarios(images):
+        if options.only and not any(text in name for text in options.only):
+            continue
+        if warm_up is not None:
+            warm_up()
+        results[name] = measure(run, setup=setup, repeat=options.repeat)
+        metrics = ", ".join(f"{metric} {format_value(metric, value)}" for metric, value in results[name].items())
+        print(f"{name}: {metrics}")
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({'environment': get_environment(), 'results': results}, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline['environment'] != get_environment():
+            print(f"Warning: baseline recorded on {baseline['environment']}")
+
+        regressions = 0
+        print()
+        for scenario, metric, old, new, regressed in compare(results, baseline['results'], options.threshold):
+            if old:
+                change = f"{(new - old) / old:+.0%}"
+            else:
+                change = "+0%" if new == old else "from 0"
+            print(
+                f"{'REGRESSED ' if regressed else ''}{scenario} {metric}: "
+                f"{format_value(metric, old)} -> {format_value(metric, new)} ({change})"
+            )
+            regressions += regressed
+        if regressions:
+            print(f"{regressions} regressions")
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    finally:
+        if not os.environ.get('WAGTAIL_PICTURE_PROPOSAL_BENCHMARK_DIR'):
+            shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+    sys.exit(status)
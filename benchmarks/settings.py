@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+from demo.settings.base import *  # noqa: F401,F403
+
+
+DEBUG = False
+
+SECRET_KEY = 'benchmarks'
+
+ALLOWED_HOSTS = ['*']
+
+# Each run starts from a fresh database and media directory.
+BENCHMARK_DIR = os.environ.get('WAGTAIL_PICTURE_PROPOSAL_BENCHMARK_DIR') or tempfile.mkdtemp(prefix='wpp-benchmarks-')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+        # Concurrent benchmarks wait for each other's writes.
+        'OPTIONS': {'timeout': 60},
+    }
+}
+
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'renditions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'renditions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# Keep the debug toolbar out of the measurements.
+MIDDLEWARE = [m for m in MIDDLEWARE if not m.startswith('debug_toolbar.')]  # noqa: F405
+
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
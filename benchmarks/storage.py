@@ -0,0 +1,38 @@
+import threading
+import time
+
+from django.core.files.storage import FileSystemStorage, Storage
+
+
+class RemoteStorage(Storage):
+    """
+    Local stand-in for remote storage such as S3: files have no local path,
+    and each file opened is counted and delayed by ``latency`` seconds.
+    """
+
+    def __init__(self, location=None, base_url=None, latency=0.05):
+        self.local = FileSystemStorage(location=location, base_url=base_url)
+        self.latency = latency
+        self.reads = 0
+        self._lock = threading.Lock()
+
+    def _open(self, name, mode='rb'):
+        with self._lock:
+            self.reads += 1
+        time.sleep(self.latency)
+        return self.local._open(name, mode)
+
+    def _save(self, name, content):
+        return self.local._save(name, content)
+
+    def delete(self, name):
+        self.local.delete(name)
+
+    def exists(self, name):
+        return self.local.exists(name)
+
+    def size(self, name):
+        return self.local.size(name)
+
+    def url(self, name):
+        return self.local.url(name)
@@ -88,6 +88,7 @@ DEBUG_TOOLBAR_PANELS = [
     'debug_toolbar.panels.redirects.RedirectsPanel',
     'debug_toolbar.panels.profiling.ProfilingPanel',
     "template_profiler_panel.panels.template.TemplateProfilerPanel",
+    "wagtail_picture_proposal.panels.RenditionsPanel",
 ]
 
 ROOT_URLCONF = 'demo.urls'
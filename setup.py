@@ -23,10 +23,10 @@ setup(
     author=__author__,
     license=__license__,
     copyright=__copyright__,
-    packages=find_packages(include=["wagtail_picture_proposal"]),
+    packages=find_packages(include=["wagtail_picture_proposal", "wagtail_picture_proposal.*"]),
     include_package_data=True,
     package_data={
-        "": ["templates/*"],
+        "": ["templates/*", "templates/wagtail_picture_proposal/panels/*"],
     },
     python_requires=">=3.7",
 )
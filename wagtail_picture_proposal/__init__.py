@@ -0,0 +1 @@
+default_app_config = 'wagtail_picture_proposal.apps.WagtailPictureProposalAppConfig'
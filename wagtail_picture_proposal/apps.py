@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class WagtailPictureProposalAppConfig(AppConfig):
+    name = 'wagtail_picture_proposal'
+    label = 'wagtail_picture_proposal'
+    verbose_name = "Wagtail picture proposal"
+
+    def ready(self):
+        from wagtail_picture_proposal.signal_handlers import register_signal_handlers
+        register_signal_handlers()
@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from wagtail.images import get_image_model
+
+from wagtail_picture_proposal.cache import RenditionRecord, invalidate_fragments
+from wagtail_picture_proposal.predictions import get_predicted_urls, predict_rendition_record
+
+
+logger = logging.getLogger('wagtail_picture_proposal')
+
+# Transparent 1x1 GIF, used when no rendition of the image exists yet.
+DEFAULT_PLACEHOLDER_URL = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+
+_queue = queue.Queue()
+_pending = set()
+_pending_lock = threading.Lock()
+_worker = None
+
+
+def get_background_mode():
+    """
+    How missing renditions are generated, set with ``WAGTAIL_PICTURE_PROPOSAL_BACKGROUND_RENDITIONS``:
+    None to generate them while rendering (default), "thread" for an in-process worker thread,
+    or "database" for a queue table drained by the ``process_rendition_jobs`` management command.
+    """
+    mode = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_BACKGROUND_RENDITIONS', None)
+    if mode not in (None, 'thread', 'database'):
+        raise ValueError(f"WAGTAIL_PICTURE_PROPOSAL_BACKGROUND_RENDITIONS should be None, 'thread' or 'database', got {mode!r}")
+    return mode
+
+
+def generate_pending_renditions(image_id, specs):
+    from wagtail_picture_proposal.shortcuts import image_get_renditions
+
+    try:
+        image = get_image_model().objects.get(pk=image_id)
+    except get_image_model().DoesNotExist:
+        return
+
+    image_get_renditions(image, specs)
+    # Swap any cached markup using placeholders for the real renditions.
+    invalidate_fragments(image_id)
+
+
+def run_worker():
+    while True:
+        image_id, specs = _queue.get()
+        try:
+            generate_pending_renditions(image_id, specs)
+        except Exception:
+            logger.exception("Failed to generate renditions %r for image %s", specs, image_id)
+        finally:
+            with _pending_lock:
+                _pending.difference_update((image_id, spec) for spec in specs)
+            close_old_connections()
+            _queue.task_done()
+
+
+def enqueue_renditions(image, filters):
+    """
+    Queue renditions to be generated in the background, in a worker thread or the database queue.
+    """
+    specs = [filter.spec for filter in filters]
+
+    if get_background_mode() == 'database':
+        from wagtail_picture_proposal.models import RenditionJob
+
+        RenditionJob.objects.bulk_create(
+            [RenditionJob(image_id=image.pk, filter_spec=spec) for spec in specs],
+            ignore_conflicts=True,
+        )
+        return
+
+    global _worker
+    with _pending_lock:
+        # Skip renditions already waiting to be generated.
+        specs = [spec for spec in specs if (image.pk, spec) not in _pending]
+        if not specs:
+            return
+        _pending.update((image.pk, spec) for spec in specs)
+
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=run_worker, name='rendition-worker', daemon=True)
+            _worker.start()
+
+    _queue.put((image.pk, specs))
+
+
+def get_placeholder_record(image, filter, records):
+    """
+    Stand-in for a rendition being generated in the background, with its predicted dimensions.
+    Its URL is predicted with ``WAGTAIL_PICTURE_PROPOSAL_PREDICTED_URLS``, otherwise the existing rendition
+    of the nearest width, or ``WAGTAIL_PICTURE_PROPOSAL_PLACEHOLDER_URL`` if there is none.
+
+    :param records: RenditionRecord objects of the image to pick from
+    """
+    if get_predicted_urls():
+        return predict_rendition_record(image, filter)
+
+    placeholder = predict_rendition_record(image, filter, url='')
+
+    candidates = [record for record in records if not record.placeholder]
+    # Prefer renditions in the same format, so <source> elements keep their type.
+    candidates = [record for record in candidates if record.format == placeholder.format] or candidates
+    if candidates:
+        placeholder.url = min(candidates, key=lambda record: abs(record.width - placeholder.width)).url
+    else:
+        placeholder.url = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_PLACEHOLDER_URL', DEFAULT_PLACEHOLDER_URL)
+
+    return placeholder
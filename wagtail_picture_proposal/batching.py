@@ -0,0 +1,91 @@
+import re
+import secrets
+from contextvars import ContextVar
+
+from wagtail_picture_proposal.background import get_background_mode
+from wagtail_picture_proposal.cache import get_rendition_lru
+from wagtail_picture_proposal.shortcuts import get_renditions_for_images
+
+
+_current_batch = ContextVar('wagtail_picture_proposal_batch', default=None)
+
+
+def get_current_batch():
+    return _current_batch.get()
+
+
+def get_rendition_cache_keys(image, filters):
+    Rendition = image.get_rendition_model()
+    return [Rendition.construct_cache_key(image.id, filter.get_cache_key(image), filter.spec) for filter in filters]
+
+
+class TagBatch:
+    """
+    Picture tags of a response, rendered as placeholders in a first pass,
+    then resolved together with get_renditions_for_images and substituted in the content.
+    """
+
+    def __init__(self):
+        # Random, so placeholders can’t be forged by page content.
+        self.token = secrets.token_hex(8)
+        self.pattern = re.compile(f"<!--picture-{self.token}-([0-9]+)-->")
+        # List of (image, filters, render function).
+        self.tags = []
+
+    def add(self, image, filters, render):
+        self.tags.append((image, filters, render))
+        return f"<!--picture-{self.token}-{len(self.tags) - 1}-->"
+
+    def resolve(self, content):
+        # Tags with all their records in the in-process LRU render without any round-trip,
+        # only the others are fetched together.
+        lru = get_rendition_lru()
+        # The same image instance can be used by several tags.
+        images = {}
+        filters_by_image = {}
+        for image, filters, render in self.tags:
+            if lru is not None and lru.has_all(get_rendition_cache_keys(image, filters)):
+                continue
+            images[id(image)] = image
+            filters_by_image.setdefault(id(image), {}).update((filter.spec, filter) for filter in filters)
+        if len(images) > 0:
+            get_renditions_for_images(
+                images.values(),
+                lambda image: list(filters_by_image[id(image)].values()),
+                generate=get_background_mode() is None,
+            )
+
+        # The renditions are attached to the images, so tags render without further queries.
+        outputs = [str(render()) for image, filters, render in self.tags]
+        return self.pattern.sub(lambda match: outputs[int(match.group(1))], content)
+
+
+class TagBatchingMiddleware:
+    """
+    Renders template responses in two passes: the picture tags are collected as placeholders,
+    then all their renditions fetched with a single query, and generated in one batch per image.
+    Tags using ``as`` and Jinja2 functions called with ``as_renditions=True`` still resolve their renditions straight away.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            # In case rendering failed before the post-render callback.
+            _current_batch.set(None)
+
+    def process_template_response(self, request, response):
+        batch = TagBatch()
+        _current_batch.set(batch)
+
+        def resolve_tags(response):
+            # Tags rendered while resolving mustn’t be deferred again.
+            _current_batch.set(None)
+            if len(batch.tags) > 0:
+                response.content = batch.resolve(response.content.decode(response.charset))
+
+        response.add_post_render_callback(resolve_tags)
+        return response
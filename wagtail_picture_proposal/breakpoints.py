@@ -0,0 +1,196 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+
+from wagtail.images.models import Filter
+
+from wagtail_picture_proposal.locks import rendition_lock
+from wagtail_picture_proposal.originals import get_file_hash
+from wagtail_picture_proposal.processing import generate_renditions
+
+
+auto_width_pattern = re.compile(r"^width-auto\[(\d+)\.\.(\d+)(?:,step=(\d+)(b|kb|mb))?\]$")
+
+BYTE_UNITS = {
+    'b': 1,
+    'kb': 1024,
+    'mb': 1024 * 1024,
+}
+
+# Widths measured to pick the breakpoints of an image, sizes in between are interpolated.
+SAMPLES = 8
+
+
+def parse_auto_width(operation):
+    """
+    Parse a ``width-auto[min..max,step=20kb]`` operation.
+
+    :return: (min width, max width, bytes between breakpoints), or None for other operations
+    """
+    if not operation.startswith('width-auto'):
+        return None
+    match = auto_width_pattern.match(operation)
+    if not match:
+        raise ValueError(f"expected width-auto[min..max] or width-auto[min..max,step=20kb], got {operation!r}")
+
+    min_width, max_width = int(match.group(1)), int(match.group(2))
+    if not 0 < min_width <= max_width:
+        raise ValueError(f"width-auto range should be increasing, got {operation!r}")
+    if match.group(3):
+        step = int(match.group(3)) * BYTE_UNITS[match.group(4)]
+    else:
+        step = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_BREAKPOINT_STEP', 20 * 1024)
+    if step <= 0:
+        raise ValueError(f"width-auto step should be greater than 0, got {operation!r}")
+    return min_width, max_width, step
+
+
+def find_auto_width(spec):
+    """
+    :return: (index of the width-auto operation in the spec, parsed operation), or None
+    """
+    for i, operation in enumerate(spec.split('|')):
+        auto_width = parse_auto_width(operation)
+        if auto_width is not None:
+            return i, auto_width
+    return None
+
+
+def replace_operation(spec, index, operation):
+    operations = spec.split('|')
+    operations[index] = operation
+    return '|'.join(operations)
+
+
+def sample_specs(specs):
+    """
+    Specs with ``width-auto`` operations replaced by their maximum width, to validate the other operations
+    without an image.
+    """
+    sampled = []
+    for spec in specs:
+        auto_width = find_auto_width(spec)
+        if auto_width is not None:
+            index, (min_width, max_width, step) = auto_width
+            spec = replace_operation(spec, index, f"width-{max_width}")
+        sampled.append(spec)
+    return tuple(sampled)
+
+
+def pick_breakpoints(sizes, min_width, max_width, step):
+    """
+    Pick widths between min_width and max_width so consecutive renditions differ by about ``step`` bytes.
+
+    :param sizes: list of (width, bytes) measured, in increasing width
+    """
+    def size_at(width):
+        # Linear interpolation between the measured widths.
+        for (width_a, size_a), (width_b, size_b) in zip(sizes, sizes[1:]):
+            if width <= width_b:
+                return size_a + (size_b - size_a) * (width - width_a) / (width_b - width_a)
+        return sizes[-1][1]
+
+    widths = [min_width]
+    last_size = size_at(min_width)
+    for width in range(min_width + 1, max_width + 1):
+        size = size_at(width)
+        if size - last_size >= step:
+            widths.append(width)
+            last_size = size
+
+    if widths[-1] != max_width:
+        # Always offer the largest width, in place of the last breakpoint if it’s close to it.
+        if len(widths) > 1 and size_at(max_width) - last_size < step / 2:
+            widths[-1] = max_width
+        else:
+            widths.append(max_width)
+    return widths
+
+
+def measure_breakpoints(image, spec):
+    """
+    Encode renditions of the spec at a few widths, from a single decode of the source,
+    and pick breakpoints from their sizes. Widths are capped to the source width, to never upscale.
+    """
+    index, (min_width, max_width, step) = find_auto_width(spec)
+    max_width = min(max_width, image.width)
+    min_width = min(min_width, max_width)
+    if min_width == max_width:
+        return [max_width]
+
+    sample_widths = sorted({
+        round(min_width + (max_width - min_width) * i / (SAMPLES - 1)) for i in range(SAMPLES)
+    })
+    filters = [Filter(spec=replace_operation(spec, index, f"width-{width}")) for width in sample_widths]
+    sizes = [
+        (width, len(generated_image.f.getvalue()))
+        for width, generated_image in zip(sample_widths, generate_renditions(image, filters))
+    ]
+    return pick_breakpoints(sizes, min_width, max_width, step)
+
+
+def get_breakpoints_cache_key(image, spec, file_hash):
+    return f"picture-breakpoints-{image.pk}-{file_hash}-{hashlib.md5(spec.encode('utf-8')).hexdigest()}"
+
+
+def get_breakpoints(image, spec):
+    """
+    Widths of a ``width-auto`` spec for the image, measured once per image file and stored in the database,
+    with the ``renditions`` cache in front.
+    """
+    from wagtail_picture_proposal.models import RenditionBreakpoints
+
+    file_hash = get_file_hash(image)
+    cache_key = get_breakpoints_cache_key(image, spec, file_hash)
+    try:
+        cache = caches['renditions']
+    except InvalidCacheBackendError:
+        cache = None
+    else:
+        widths = cache.get(cache_key)
+        if widths is not None:
+            return widths
+
+    def get_saved_widths():
+        saved = RenditionBreakpoints.objects.filter(image=image, filter_spec=spec, file_hash=file_hash).first()
+        return [int(width) for width in saved.widths.split(',')] if saved else None
+
+    widths = get_saved_widths()
+    if widths is None:
+        # Concurrent renders of the image wait for a single measurement.
+        with rendition_lock(image):
+            widths = get_saved_widths()
+            if widths is None:
+                widths = measure_breakpoints(image, spec)
+                RenditionBreakpoints.objects.update_or_create(
+                    image=image,
+                    filter_spec=spec,
+                    defaults={'file_hash': file_hash, 'widths': ','.join(str(width) for width in widths)},
+                )
+
+    if cache is not None:
+        cache.set(cache_key, widths)
+    return widths
+
+
+def expand_breakpoints(image, specs):
+    """
+    Replace the ``width-auto`` specs given to a tag by one spec per breakpoint of the image.
+
+    :param specs: tuple of str filter specs
+    :return: tuple of str filter specs
+    """
+    if not any('width-auto' in spec for spec in specs):
+        return specs
+
+    expanded = []
+    for spec in specs:
+        auto_width = find_auto_width(spec)
+        if auto_width is None:
+            expanded.append(spec)
+            continue
+        index = auto_width[0]
+        expanded.extend(replace_operation(spec, index, f"width-{width}") for width in get_breakpoints(image, spec))
+    return tuple(expanded)
@@ -0,0 +1,210 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_file_format(name):
+    ext = name.lower().split(".").pop()
+    if ext in ("jpg", "jpeg"):
+        return "jpeg"
+    return ext
+
+
+class RenditionRecord:
+    """
+    The parts of a rendition needed to write markup, without the overhead of a model instance.
+    """
+
+    __slots__ = ('url', 'width', 'height', 'format', 'placeholder', 'file_size')
+
+    def __init__(self, url, width, height, format, placeholder=False, file_size=None):
+        self.url = url
+        self.width = width
+        self.height = height
+        self.format = format
+        # Stands in for a rendition which hasn’t been generated yet, and mustn’t be cached.
+        self.placeholder = placeholder
+        # In bytes, if known.
+        self.file_size = file_size
+
+    @classmethod
+    def from_rendition(cls, rendition):
+        return cls(
+            rendition.url,
+            rendition.width,
+            rendition.height,
+            get_file_format(rendition.file.name),
+            file_size=getattr(rendition, 'picture_file_size', None),
+        )
+
+    def __repr__(self):
+        return f"<RenditionRecord: {self.url} {self.width}x{self.height}>"
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded in-process cache, with a per-entry timeout.
+    Keeps counters of hits, misses, evictions (entries dropped to make room),
+    and expirations (entries dropped once past their timeout).
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                try:
+                    expires, value = self._data[key]
+                except KeyError:
+                    self.misses += 1
+                    continue
+
+                if expires is not None and expires <= now:
+                    del self._data[key]
+                    self.expirations += 1
+                    self.misses += 1
+                    continue
+
+                self._data.move_to_end(key)
+                found[key] = value
+                self.hits += 1
+        return found
+
+    def has_all(self, keys):
+        """
+        Whether all keys are cached and not expired, without counting hits or misses.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None or (entry[0] is not None and entry[0] <= now):
+                    return False
+        return True
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+_rendition_lru = None
+_rendition_lru_lock = threading.Lock()
+
+
+def get_rendition_lru():
+    """
+    Return the in-process cache of rendition records, configured with
+    ``WAGTAIL_PICTURE_PROPOSAL_LRU_SIZE`` (number of records, 0 to disable)
+    and ``WAGTAIL_PICTURE_PROPOSAL_LRU_TIMEOUT`` (seconds).
+    """
+    global _rendition_lru
+
+    max_size = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_LRU_SIZE', 1000)
+    timeout = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_LRU_TIMEOUT', 300)
+    if not max_size:
+        return None
+
+    with _rendition_lru_lock:
+        if _rendition_lru is None or (_rendition_lru.max_size, _rendition_lru.timeout) != (max_size, timeout):
+            _rendition_lru = LRUCache(max_size, timeout)
+        return _rendition_lru
+
+
+def get_fragment_cache():
+    """
+    Return the cache storing the HTML output of picture tags, set with
+    ``WAGTAIL_PICTURE_PROPOSAL_FRAGMENT_CACHE`` (a cache alias), or None if disabled.
+    """
+    alias = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_FRAGMENT_CACHE', None)
+    if not alias:
+        return None
+    return caches[alias]
+
+
+def get_fragment_timeout():
+    return getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_FRAGMENT_CACHE_TIMEOUT', 3600)
+
+
+def get_fragment_version_key(image_id):
+    return f"wpp-fragment-version-{image_id}"
+
+
+def get_fragment_version(cache, image_id):
+    """
+    Fragments are keyed by a per-image version, so they can all be invalidated at once.
+    A missing version is replaced with a new one, never reusing a version from before it was evicted.
+    """
+    version_key = get_fragment_version_key(image_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+    return version
+
+
+def invalidate_fragments(image_id):
+    cache = get_fragment_cache()
+    if cache is not None:
+        cache.set(get_fragment_version_key(image_id), time.time_ns(), timeout=None)
+
+
+def get_fragment_key(cache, image, tag_name, filters, attrs):
+    """
+    Key for the HTML output of a tag: covers the image file and focal point,
+    the compiled filter specs, and the resolved attribute values.
+    """
+    parts = (
+        tag_name,
+        image.file.name,
+        getattr(image, 'file_hash', ''),
+        image.focal_point_x,
+        image.focal_point_y,
+        image.focal_point_width,
+        image.focal_point_height,
+        tuple(filter.spec for filter in filters),
+        tuple((name, str(value)) for name, value in attrs.items()),
+    )
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+    return f"wpp-fragment-{image.pk}-{get_fragment_version(cache, image.pk)}-{digest}"
@@ -0,0 +1,177 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.db import transaction
+
+from wagtail.images import get_image_model
+from wagtail.images.exceptions import InvalidFilterSpecError
+from wagtail.images.models import Filter
+
+from wagtail_picture_proposal.cache import get_rendition_lru, invalidate_fragments
+from wagtail_picture_proposal.manifests import invalidate_manifests, purge_image_manifests
+
+
+def purge_rendition_caches(rendition_keys):
+    """
+    Drop renditions from the ``renditions`` cache and the in-process LRU of this process.
+
+    :param rendition_keys: list of (image id, focal point key, filter spec)
+    """
+    Rendition = get_image_model().get_rendition_model()
+    cache_keys = [
+        Rendition.construct_cache_key(image_id, focal_point_key, filter_spec)
+        for image_id, focal_point_key, filter_spec in rendition_keys
+    ]
+    if len(cache_keys) == 0:
+        return
+
+    try:
+        caches['renditions'].delete_many(cache_keys)
+    except InvalidCacheBackendError:
+        pass
+    lru = get_rendition_lru()
+    if lru is not None:
+        lru.delete_many(cache_keys)
+
+
+def purge_image_caches(image):
+    """
+    Drop all known renditions of the image from the caches, e.g. once its file or focal point changed.
+    """
+    purge_rendition_caches(list(
+        image.renditions.values_list('image_id', 'focal_point_key', 'filter_spec')
+    ))
+    purge_image_manifests(image.pk)
+
+
+def find_orphan_renditions(chunk_size=500):
+    """
+    Renditions which can’t be served anymore: of a deleted image, or cropped around a previous focal point.
+
+    :return: iterator of (pk, image id, focal point key, filter spec, file name)
+    """
+    Image = get_image_model()
+    Rendition = Image.get_rendition_model()
+    # A single Filter per spec, as they cache their parsed operations.
+    filters = {}
+
+    last_pk = 0
+    while True:
+        rows = list(
+            Rendition.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', 'image_id', 'focal_point_key', 'filter_spec', 'file')[:chunk_size]
+        )
+        if len(rows) == 0:
+            return
+        last_pk = rows[-1][0]
+
+        images = Image.objects.in_bulk({image_id for pk, image_id, focal_point_key, filter_spec, file in rows})
+        for row in rows:
+            pk, image_id, focal_point_key, filter_spec, file = row
+            image = images.get(image_id)
+            if image is None:
+                yield row
+                continue
+            if not focal_point_key:
+                continue
+
+            if filter_spec not in filters:
+                filters[filter_spec] = Filter(spec=filter_spec)
+            try:
+                current_key = filters[filter_spec].get_cache_key(image)
+            except InvalidFilterSpecError:
+                # Specs no longer valid are left to whoever removed them.
+                continue
+            if current_key != focal_point_key:
+                yield row
+
+
+def find_orphan_files(min_age, chunk_size=500):
+    """
+    Files in the renditions directory of the storage with no rendition in the database,
+    e.g. left behind when deleting renditions failed. Files newer than ``min_age`` seconds are skipped,
+    as renditions are saved to the storage before the database.
+
+    :return: iterator of file names
+    """
+    Rendition = get_image_model().get_rendition_model()
+    storage = Rendition._meta.get_field('file').storage
+    # Where Wagtail’s AbstractRendition.get_upload_to saves files.
+    directory = 'images'
+
+    try:
+        dirs, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    names = [f"{directory}/{file}" for file in files]
+    now = time.time()
+
+    for i in range(0, len(names), chunk_size):
+        chunk = names[i:i + chunk_size]
+        known = set(Rendition.objects.filter(file__in=chunk).values_list('file', flat=True))
+        for name in chunk:
+            if name in known:
+                continue
+            if min_age and now - storage.get_modified_time(name).timestamp() < min_age:
+                continue
+            yield name
+
+
+def delete_files(names, workers):
+    """
+    Delete files from the renditions storage, with concurrent requests as each can take a round-trip
+    to remote storage.
+
+    :return: list of (file name, error) failures
+    """
+    storage = get_image_model().get_rendition_model()._meta.get_field('file').storage
+
+    def delete(name):
+        try:
+            storage.delete(name)
+        except Exception as e:
+            return name, str(e)
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [failure for failure in executor.map(delete, names) if failure is not None]
+
+
+def delete_renditions(rows, workers):
+    """
+    Delete renditions in bulk: their rows with a single query, their file sizes, manifests and cache entries,
+    then their files concurrently.
+
+    :param rows: list of (pk, image id, focal point key, filter spec, file name), as from find_orphan_renditions
+    :return: list of (file name, error) failures
+    """
+    from wagtail_picture_proposal.models import RenditionFileSize
+    from wagtail_picture_proposal.shortcuts import get_rendition_keys_q
+
+    if len(rows) == 0:
+        return []
+    Rendition = get_image_model().get_rendition_model()
+
+    specs_by_image = {}
+    for pk, image_id, focal_point_key, filter_spec, file in rows:
+        specs_by_image.setdefault(image_id, []).append((filter_spec, focal_point_key))
+
+    with transaction.atomic():
+        # Skips the per-rendition post_delete handlers, which would delete files one at a time.
+        # Everything they do is done below for the whole batch.
+        Rendition.objects.filter(pk__in=[row[0] for row in rows])._raw_delete(Rendition.objects.db)
+        RenditionFileSize.objects.filter(get_rendition_keys_q(
+            (image_id, filter_spec, focal_point_key) for pk, image_id, focal_point_key, filter_spec, file in rows
+        )).delete()
+        for image_id, renditions in specs_by_image.items():
+            invalidate_manifests(image_id, renditions)
+
+    purge_rendition_caches([
+        (image_id, focal_point_key, filter_spec) for pk, image_id, focal_point_key, filter_spec, file in rows
+    ])
+    for image_id in specs_by_image:
+        invalidate_fragments(image_id)
+
+    return delete_files([file for pk, image_id, focal_point_key, filter_spec, file in rows if file], workers)
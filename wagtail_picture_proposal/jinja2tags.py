@@ -0,0 +1,130 @@
+from django import template
+from jinja2.ext import Extension
+from markupsafe import Markup, escape
+
+from wagtail.images.exceptions import InvalidFilterSpecError
+
+from wagtail_picture_proposal.breakpoints import expand_breakpoints, sample_specs
+from wagtail_picture_proposal.shortcuts import get_renditions_or_not_found
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters
+from wagtail_picture_proposal.templatetags.wagtailpictureproposal_tags import (
+    allowed_filter_pattern,
+    compile_picture_filters,
+    extract_native_format,
+    get_picture_context,
+    parse_picture_options,
+    render_cached,
+)
+
+
+def get_filters(tag_name, filter_specs):
+    for spec in filter_specs:
+        if not allowed_filter_pattern.match(spec):
+            raise template.TemplateSyntaxError(
+                f"filter specs in '{tag_name}' may only contain A-Z, a-z, 0-9, dots, colons, commas, hyphens, curly braces, square brackets, equals signs, and underscores. "
+                f"(given filter: {spec})"
+            )
+    try:
+        specs = compile_filter_specs(tuple(filter_specs))
+        sample_specs(specs)
+    except ValueError as e:
+        raise template.TemplateSyntaxError(f"{tag_name}: {e}")
+    return specs
+
+
+def format_srcset(renditions):
+    return ", ".join(f"{rendition.url} {rendition.width}w" for rendition in renditions)
+
+
+def format_attrs(attrs):
+    return "".join(f' {name}="{escape(value)}"' for name, value in attrs.items())
+
+
+def img_srcset_markup(renditions, attrs):
+    srcset = f' srcset="{escape(format_srcset(renditions))}"' if len(renditions) > 1 else ""
+    return Markup(
+        f'<img{srcset} src="{escape(renditions[0].url)}" width="{renditions[0].width}" '
+        f'height="{renditions[0].height}"{format_attrs(attrs)}>'
+    )
+
+
+def webp_picture_markup(picture, attrs):
+    sizes = attrs.pop("sizes", None)
+    sizes_attr = f' sizes="{escape(sizes)}"' if sizes else ""
+    fallback = picture["fallback"]
+    webp_source = (
+        f'<source srcset="{escape(format_srcset(picture["webp_source"]))}" type="image/webp"{sizes_attr}>'
+        if picture["use_webp_source"] else ""
+    )
+    return Markup(
+        f'<picture>'
+        f'{webp_source}'
+        f'<source srcset="{escape(format_srcset(picture["fallback_source"]))}" type="{picture["fallback_mime"]}"{sizes_attr}>'
+        f'<img src="{escape(fallback.url)}" width="{fallback.width}" height="{fallback.height}"{format_attrs(attrs)}>'
+        f'</picture>'
+    )
+
+
+def img_srcset_wip(image, *filter_specs, as_renditions=False, **attrs):
+    """
+    Like the img_srcset_wip template tag: ``{{ img_srcset_wip(page.photo, "width-{320,640}", alt="") }}``.
+    With ``as_renditions=True``, returns the list of Rendition objects instead of markup, like the tag's ``as`` form.
+    """
+    if not image:
+        return ''
+
+    try:
+        filters = compile_filters(expand_breakpoints(image, get_filters('img_srcset_wip', filter_specs)))
+    except InvalidFilterSpecError as e:
+        raise template.TemplateSyntaxError(f"img_srcset_wip: {e}")
+
+    if as_renditions:
+        return get_renditions_or_not_found(image, filters)
+
+    # Cached separately from the template tag, which has different markup.
+    return Markup(render_cached(
+        'jinja2-img_srcset_wip', image, filters, attrs,
+        lambda renditions: img_srcset_markup(renditions, attrs),
+    ))
+
+
+def webp_picture_wip(image, *filter_specs, as_renditions=False, **attrs):
+    """
+    Like the webp_picture_wip template tag: ``{{ webp_picture_wip(page.photo, "width-{320,640}", "q-80", sizes="50vw") }}``.
+    With ``as_renditions=True``, returns the WebP and fallback Rendition objects instead of markup, like the tag's ``as`` form.
+    """
+    if not image:
+        return ''
+
+    source_filter_specs, specified_format, quality = parse_picture_options(filter_specs)
+    try:
+        filters = compile_picture_filters(
+            expand_breakpoints(image, get_filters('webp_picture_wip', source_filter_specs)),
+            extract_native_format(image),
+            specified_format,
+            quality,
+        )
+    except InvalidFilterSpecError as e:
+        raise template.TemplateSyntaxError(f"webp_picture_wip: {e}")
+
+    if as_renditions:
+        return get_picture_context(get_renditions_or_not_found(image, filters))
+
+    return Markup(render_cached(
+        'jinja2-webp_picture_wip', image, filters, attrs,
+        lambda renditions: webp_picture_markup(get_picture_context(renditions), dict(attrs)),
+    ))
+
+
+class WagtailPictureProposalExtension(Extension):
+    def __init__(self, environment):
+        super().__init__(environment)
+
+        self.environment.globals.update({
+            'img_srcset_wip': img_srcset_wip,
+            'webp_picture_wip': webp_picture_wip,
+        })
+
+
+# Nicer import names
+picture_proposal = WagtailPictureProposalExtension
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, router
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def get_lock_id(name):
+    # PostgreSQL advisory locks are identified by a signed 64-bit integer.
+    return int.from_bytes(hashlib.sha1(name.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def get_lock_dir():
+    lock_dir = getattr(
+        settings,
+        'WAGTAIL_PICTURE_PROPOSAL_LOCK_DIR',
+        os.path.join(tempfile.gettempdir(), 'wagtail_picture_proposal_locks'),
+    )
+    os.makedirs(lock_dir, exist_ok=True)
+    return lock_dir
+
+
+@contextmanager
+def advisory_lock(connection, name):
+    lock_id = get_lock_id(name)
+    with connection.cursor() as cursor:
+        if connection.in_atomic_block:
+            # Released on commit, once the renditions are visible to other workers.
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [lock_id])
+            yield
+        else:
+            cursor.execute("SELECT pg_advisory_lock(%s)", [lock_id])
+            try:
+                yield
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+
+
+@contextmanager
+def file_lock(name):
+    if fcntl is None:
+        yield
+        return
+
+    with open(os.path.join(get_lock_dir(), f"{name}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def rendition_lock(image):
+    """
+    Cross-process lock to hold while generating renditions of the image, so concurrent workers
+    wait for each other rather than generating the same renditions.
+    Uses advisory locks on PostgreSQL, and lock files in ``WAGTAIL_PICTURE_PROPOSAL_LOCK_DIR`` otherwise.
+    """
+    Rendition = image.get_rendition_model()
+    connection = connections[router.db_for_write(Rendition)]
+    name = f"image-{image.pk}"
+
+    if connection.vendor == 'postgresql':
+        with advisory_lock(connection, f"wagtail_picture_proposal-{name}"):
+            yield
+    else:
+        with file_lock(name):
+            yield
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same keys within the process: the first caller
+    of a key computes its value, and callers arriving in the meantime wait for it.
+    Waiters which time out compute the value themselves.
+    Keeps counters of keys computed, waits collapsed, and waits timed out.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.collapsed = 0
+        self.timeouts = 0
+
+    def run(self, keys, fn):
+        """
+        :param keys: hashable keys to get the values of
+        :param fn: called with the keys no other thread is computing, returns a dict of their values
+        :return: dict of values for all the keys
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._futures.get(key)
+                if future is None:
+                    self._futures[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+            self.calls += len(owned)
+            self.collapsed += len(waiting)
+
+        results = {}
+        if owned:
+            # Compute our own keys before waiting on others, so threads never wait on each other in a cycle.
+            try:
+                results = fn(owned)
+            except BaseException as e:
+                self._finish(owned, exception=e)
+                raise
+            self._finish(owned, results)
+
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        late = []
+        for key, future in waiting.items():
+            try:
+                remaining = max(0, deadline - time.monotonic()) if deadline is not None else None
+                results[key] = future.result(timeout=remaining)
+            except TimeoutError:
+                late.append(key)
+
+        if late:
+            with self._lock:
+                self.timeouts += len(late)
+            results.update(fn(late))
+
+        return results
+
+    def _finish(self, keys, results=None, exception=None):
+        with self._lock:
+            futures = [self._futures.pop(key) for key in keys]
+        for key, future in zip(keys, futures):
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(results.get(key))
+
+    def get_stats(self):
+        return {
+            'in_flight': len(self._futures),
+            'calls': self.calls,
+            'collapsed': self.collapsed,
+            'timeouts': self.timeouts,
+        }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Return the single-flight layer shared by the threads of the process, or None if disabled with
+    ``WAGTAIL_PICTURE_PROPOSAL_SINGLE_FLIGHT``. Threads wait on each other for at most
+    ``WAGTAIL_PICTURE_PROPOSAL_SINGLE_FLIGHT_TIMEOUT`` seconds.
+    """
+    global _single_flight
+
+    if not getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_SINGLE_FLIGHT', True):
+        return None
+    timeout = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_SINGLE_FLIGHT_TIMEOUT', 30)
+
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(timeout)
+        _single_flight.timeout = timeout
+        return _single_flight
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wagtail_picture_proposal.cleanup import delete_files, delete_renditions, find_orphan_files, find_orphan_renditions
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete renditions which can't be served anymore: of deleted images, or cropped around a previous focal point. "
+        "Rows are deleted in bulk, and files with concurrent requests to the storage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of renditions deleted at once")
+        parser.add_argument('--workers', type=int, default=16, help="Number of concurrent file deletions")
+        parser.add_argument('--dry-run', action='store_true', help="List the renditions to delete without deleting them")
+        parser.add_argument(
+            '--files', action='store_true',
+            help="Also delete files in the renditions directory of the storage with no rendition in the database",
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help="Seconds since the last modification of files deleted with --files, to skip renditions being saved",
+        )
+
+    def handle(self, **options):
+        self.verbosity = options['verbosity']
+        start = time.monotonic()
+
+        batch = []
+        deleted = 0
+        failed = 0
+        for row in find_orphan_renditions(options['batch_size']):
+            batch.append(row)
+            if len(batch) == options['batch_size']:
+                failed += self.delete_batch(batch, options)
+                deleted += len(batch)
+                batch = []
+        if len(batch) > 0:
+            failed += self.delete_batch(batch, options)
+            deleted += len(batch)
+
+        action = "Found" if options['dry_run'] else "Deleted"
+        self.stdout.write(f"{action} {deleted} orphan renditions")
+
+        if options['files']:
+            names = list(find_orphan_files(options['min_age'], options['batch_size']))
+            if self.verbosity > 1:
+                for name in names:
+                    self.stdout.write(f"File {name}")
+            if not options['dry_run']:
+                failed += self.report_failures(delete_files(names, options['workers']))
+            self.stdout.write(f"{action} {len(names)} orphan files")
+
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - start:.1f}s, {failed} files failed"))
+
+    def delete_batch(self, batch, options):
+        if self.verbosity > 1:
+            for pk, image_id, focal_point_key, filter_spec, file in batch:
+                self.stdout.write(f"Rendition {pk}: {filter_spec} for image {image_id}, {file}")
+        if options['dry_run']:
+            return 0
+        return self.report_failures(delete_renditions(batch, options['workers']))
+
+    def report_failures(self, failures):
+        for name, error in failures:
+            self.stderr.write(f"Failed to delete {name}: {error}")
+        return len(failures)
@@ -0,0 +1,153 @@
+import json
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+
+from wagtail.images import get_image_model
+from wagtail.images.models import SourceImageIOError
+
+from wagtail_picture_proposal.processing import setup_worker_process
+from wagtail_picture_proposal.shortcuts import image_get_renditions
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters
+
+
+def generate_chunk(image_ids, specs):
+    """
+    Worker entry point: generate the missing renditions for a batch of images, fetched in a single query.
+    Returns the number of images processed, and a list of (image id, error message) failures.
+    """
+    filters = compile_filters(specs)
+    failures = []
+    images = get_image_model().objects.filter(pk__in=image_ids)
+    for image in images:
+        try:
+            image_get_renditions(image, filters)
+        except (SourceImageIOError, IOError) as e:
+            failures.append((image.pk, str(e)))
+    close_old_connections()
+    return len(image_ids), failures
+
+
+def generate_chunk_star(args):
+    return generate_chunk(*args)
+
+
+def setup_worker():
+    setup_worker_process()
+    # Forked workers mustn't reuse the parent's database connections.
+    for connection in connections.all():
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate missing renditions for many images ahead of time. "
+        "Specs can be literal, brace-expanded, or names from WAGTAIL_PICTURE_PROPOSAL_NAMED_FILTERS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('specs', nargs='+', help="Filter specs, e.g. width-{320,640} fill-100x100")
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='LOOKUP=VALUE',
+            help="Only process images matching this queryset lookup, e.g. collection__name=Blog. Can be repeated.",
+        )
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument('--chunk-size', type=int, default=50, help="Number of images per batch")
+        parser.add_argument('--checkpoint', help="File to record progress in, resuming from it if it exists")
+
+    def handle(self, *args, **options):
+        specs = []
+        for raw_spec in options['specs']:
+            try:
+                compiled_specs = compile_filter_specs((raw_spec,))
+                compile_filters(compiled_specs)
+            except Exception as e:
+                raise CommandError(f"Invalid filter spec {raw_spec!r}: {e}")
+            specs.extend(spec for spec in compiled_specs if spec not in specs)
+        specs = tuple(specs)
+
+        lookups = {}
+        for lookup in options['filter']:
+            try:
+                name, value = lookup.split('=', 1)
+            except ValueError:
+                raise CommandError(f"--filter should be of the form lookup=value, got {lookup!r}")
+            lookups[name] = value
+
+        checkpoint = self.read_checkpoint(options['checkpoint'], specs, lookups)
+        last_id = checkpoint['last_id'] if checkpoint else None
+
+        images = get_image_model().objects.filter(**lookups).order_by('pk')
+        if last_id is not None:
+            images = images.filter(pk__gt=last_id)
+            self.stdout.write(f"Resuming after image {last_id}")
+        image_ids = list(images.values_list('pk', flat=True))
+        chunk_size = options['chunk_size']
+        chunks = [image_ids[i:i + chunk_size] for i in range(0, len(image_ids), chunk_size)]
+
+        total = len(image_ids)
+        self.stdout.write(f"Generating {len(specs)} renditions for {total} images")
+        if total == 0:
+            return
+
+        processes = max(1, min(options['processes'] or 1, len(chunks)))
+        done = 0
+        failed = 0
+        start = time.monotonic()
+
+        if processes > 1:
+            connections.close_all()
+            pool = multiprocessing.Pool(processes, initializer=setup_worker)
+            results = pool.imap(generate_chunk_star, [(chunk, specs) for chunk in chunks])
+        else:
+            pool = None
+            results = (generate_chunk(chunk, specs) for chunk in chunks)
+
+        try:
+            # Results come back in order, so the checkpoint only ever records fully processed images.
+            for chunk, (count, failures) in zip(chunks, results):
+                done += count
+                failed += len(failures)
+                for image_id, error in failures:
+                    self.stderr.write(f"Image {image_id}: {error}")
+
+                self.write_checkpoint(options['checkpoint'], specs, lookups, chunk[-1])
+
+                elapsed = time.monotonic() - start
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(
+                    f"{done}/{total} images ({done / total:.0%}), "
+                    f"{rate:.1f} images/s, {rate * len(specs):.1f} renditions/s, ETA {eta:.0f}s"
+                )
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {done} images in {time.monotonic() - start:.1f}s, {failed} failed"
+        ))
+
+    def read_checkpoint(self, path, specs, lookups):
+        if not path or not os.path.exists(path):
+            return None
+
+        with open(path) as f:
+            checkpoint = json.load(f)
+
+        if checkpoint.get('specs') != list(specs) or checkpoint.get('filters') != lookups:
+            raise CommandError(f"Checkpoint {path} was recorded with different specs or filters, remove it to start over")
+        return checkpoint
+
+    def write_checkpoint(self, path, specs, lookups, last_id):
+        if not path:
+            return
+
+        # Write to a temporary file first, so an interrupted run never leaves a truncated checkpoint.
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'specs': list(specs), 'filters': lookups, 'last_id': last_id}, f)
+        os.replace(path + '.tmp', path)
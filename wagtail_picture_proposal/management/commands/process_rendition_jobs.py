@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wagtail_picture_proposal.background import generate_pending_renditions
+from wagtail_picture_proposal.models import RenditionJob
+
+
+class Command(BaseCommand):
+    help = "Generate the renditions queued in the database by the picture tags."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of queued renditions to process at once")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for new jobs once the queue is empty")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait between polls with --loop")
+
+    def handle(self, **options):
+        self.verbosity = options['verbosity']
+        while True:
+            processed = self.process_batch(options['batch_size'])
+            if processed == 0:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+
+    def process_batch(self, batch_size):
+        jobs = list(RenditionJob.objects.order_by('created_at')[:batch_size])
+
+        specs_by_image = {}
+        for job in jobs:
+            specs_by_image.setdefault(job.image_id, []).append(job.filter_spec)
+
+        for image_id, specs in specs_by_image.items():
+            try:
+                generate_pending_renditions(image_id, specs)
+            except Exception as e:
+                self.stderr.write(f"Failed to generate renditions {specs!r} for image {image_id}: {e}")
+            else:
+                if self.verbosity > 1:
+                    self.stdout.write(f"Generated {len(specs)} renditions for image {image_id}")
+
+        # Failed jobs are dropped too, rather than retried forever. The tags queue them again on the next render.
+        RenditionJob.objects.filter(pk__in=[job.pk for job in jobs]).delete()
+        return len(jobs)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.db.models import Q
+
+from wagtail_picture_proposal.cache import RenditionRecord
+
+
+def get_manifests_enabled():
+    """
+    Whether the records of a tag are stored together as a manifest, set with
+    ``WAGTAIL_PICTURE_PROPOSAL_MANIFESTS``. Defaults to True.
+    """
+    return getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_MANIFESTS', True)
+
+
+def get_specs_hash(filters):
+    return hashlib.sha1('\n'.join(filter.spec for filter in filters).encode('utf-8')).hexdigest()
+
+
+def get_manifest_focal_point_key(image, filters):
+    # Filters varying on the focal point all share the same key, others have an empty one.
+    return max((filter.get_cache_key(image) for filter in filters), default='')
+
+
+def get_manifest_cache_key(image_id, focal_point_key, specs_hash):
+    return f"picture-manifest-{image_id}-{focal_point_key}-{specs_hash}"
+
+
+def get_manifests_cache():
+    try:
+        return caches['renditions']
+    except InvalidCacheBackendError:
+        return None
+
+
+def dump_records(records):
+    return json.dumps([
+        [record.url, record.width, record.height, record.format, record.file_size] for record in records
+    ])
+
+
+def load_records(data):
+    return [
+        RenditionRecord(url, width, height, format, file_size=file_size)
+        for url, width, height, format, file_size in json.loads(data)
+    ]
+
+
+def get_manifest(image, filters):
+    """
+    Records of all the renditions of a tag, in the order of its filters,
+    from the ``renditions`` cache or the database. None if there is no manifest for them yet.
+    """
+    from wagtail_picture_proposal.models import RenditionManifest
+
+    focal_point_key = get_manifest_focal_point_key(image, filters)
+    specs_hash = get_specs_hash(filters)
+    cache_key = get_manifest_cache_key(image.pk, focal_point_key, specs_hash)
+
+    cache = get_manifests_cache()
+    if cache is not None:
+        records = cache.get(cache_key)
+        if records is not None:
+            return records
+
+    data = RenditionManifest.objects.filter(
+        image_id=image.pk, focal_point_key=focal_point_key, specs_hash=specs_hash,
+    ).values_list('records', flat=True).first()
+    if data is None:
+        return None
+
+    records = load_records(data)
+    if cache is not None:
+        cache.set(cache_key, records)
+    return records
+
+
+def save_manifest(image, filters, records):
+    """
+    Store the records of a tag’s renditions, once they have all been generated.
+    """
+    from wagtail_picture_proposal.models import RenditionManifest
+
+    if any(record.placeholder for record in records):
+        return
+
+    focal_point_key = get_manifest_focal_point_key(image, filters)
+    specs_hash = get_specs_hash(filters)
+    # Only saved when missing, and stale manifests are deleted: a concurrent request saving the same one
+    # wrote the same records. A single insert, as reading first makes concurrent writers fail on SQLite.
+    RenditionManifest.objects.bulk_create([RenditionManifest(
+        image_id=image.pk,
+        focal_point_key=focal_point_key,
+        specs_hash=specs_hash,
+        # Delimited on both sides, to find the manifests of a spec with a single "contains" lookup.
+        filter_specs='\n' + '\n'.join(filter.spec for filter in filters) + '\n',
+        records=dump_records(records),
+    )], ignore_conflicts=True)
+
+    cache = get_manifests_cache()
+    if cache is not None:
+        cache.set(get_manifest_cache_key(image.pk, focal_point_key, specs_hash), records)
+
+
+def invalidate_manifests(image_id, renditions):
+    """
+    Delete the manifests including any of the renditions, so they are rebuilt by the next tag using them,
+    with the records of their other renditions still served from the caches.
+
+    :param renditions: list of (filter spec, focal point key)
+    """
+    from wagtail_picture_proposal.models import RenditionManifest
+
+    if len(renditions) == 0:
+        return
+
+    q_objects = Q()
+    for filter_spec, focal_point_key in renditions:
+        q = Q(filter_specs__contains=f"\n{filter_spec}\n")
+        if focal_point_key:
+            q &= Q(focal_point_key=focal_point_key)
+        q_objects |= q
+
+    manifests = RenditionManifest.objects.filter(q_objects, image_id=image_id)
+    keys = list(manifests.values_list('pk', 'focal_point_key', 'specs_hash'))
+    if len(keys) == 0:
+        return
+
+    RenditionManifest.objects.filter(pk__in=[pk for pk, focal_point_key, specs_hash in keys]).delete()
+    cache = get_manifests_cache()
+    if cache is not None:
+        cache.delete_many([
+            get_manifest_cache_key(image_id, focal_point_key, specs_hash) for pk, focal_point_key, specs_hash in keys
+        ])
+
+
+def purge_image_manifests(image_id):
+    """
+    Drop the manifests of an image from the ``renditions`` cache, keeping their rows.
+    """
+    from wagtail_picture_proposal.models import RenditionManifest
+
+    cache = get_manifests_cache()
+    if cache is None:
+        return
+
+    keys = RenditionManifest.objects.filter(image_id=image_id).values_list('focal_point_key', 'specs_hash')
+    cache_keys = [get_manifest_cache_key(image_id, focal_point_key, specs_hash) for focal_point_key, specs_hash in keys]
+    if len(cache_keys) > 0:
+        cache.delete_many(cache_keys)
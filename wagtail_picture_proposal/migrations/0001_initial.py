@@ -0,0 +1,30 @@
+# Generated by Django 3.1.14 on 2026-10-18 10:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from wagtail.images import get_image_model_string
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(get_image_model_string()),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenditionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filter_spec', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=get_image_model_string())),
+            ],
+            options={
+                'unique_together': {('image', 'filter_spec')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from wagtail.images import get_image_model_string
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(get_image_model_string()),
+        ('wagtail_picture_proposal', '0003_renditionfilesize'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenditionManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('focal_point_key', models.CharField(blank=True, default='', max_length=16)),
+                ('specs_hash', models.CharField(max_length=40)),
+                ('filter_specs', models.TextField()),
+                ('records', models.TextField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=get_image_model_string())),
+            ],
+            options={
+                'unique_together': {('image', 'focal_point_key', 'specs_hash')},
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+from django.db import models
+
+from wagtail.images import get_image_model_string
+
+
+class RenditionJob(models.Model):
+    """
+    A rendition waiting to be generated in the background,
+    by the ``process_rendition_jobs`` management command.
+    """
+    image = models.ForeignKey(get_image_model_string(), on_delete=models.CASCADE, related_name='+')
+    filter_spec = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = (
+            ('image', 'filter_spec'),
+        )
+
+    def __str__(self):
+        return f"{self.filter_spec} for image {self.image_id}"
+
+
+class RenditionBreakpoints(models.Model):
+    """
+    Widths picked for a ``width-auto[…]`` filter spec of an image, by measuring the size of its renditions.
+    """
+    image = models.ForeignKey(get_image_model_string(), on_delete=models.CASCADE, related_name='+')
+    filter_spec = models.CharField(max_length=255)
+    # Hash of the image file the widths were measured on.
+    file_hash = models.CharField(max_length=40)
+    # Comma-separated widths, in increasing order.
+    widths = models.TextField()
+
+    class Meta:
+        unique_together = (
+            ('image', 'filter_spec'),
+        )
+
+    def __str__(self):
+        return f"{self.filter_spec} for image {self.image_id}: {self.widths}"
+
+
+class RenditionFileSize(models.Model):
+    """
+    Size of the file of a rendition, to pick the smallest format without asking the storage.
+    Keyed like renditions rather than referencing them, as the rendition model depends on the image model.
+    """
+    image = models.ForeignKey(get_image_model_string(), on_delete=models.CASCADE, related_name='+')
+    filter_spec = models.CharField(max_length=255)
+    focal_point_key = models.CharField(max_length=16, blank=True, default='')
+    file_size = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (
+            ('image', 'filter_spec', 'focal_point_key'),
+        )
+
+    def __str__(self):
+        return f"{self.filter_spec} for image {self.image_id}: {self.file_size} bytes"
+
+
+class RenditionManifest(models.Model):
+    """
+    Records of all the renditions of a tag, in order, so the tag is served from a single row or cache key.
+    Keyed by the image, the focal point key of its filters, and a hash of its compiled filter specs.
+    """
+    image = models.ForeignKey(get_image_model_string(), on_delete=models.CASCADE, related_name='+')
+    focal_point_key = models.CharField(max_length=16, blank=True, default='')
+    specs_hash = models.CharField(max_length=40)
+    # Newline-delimited filter specs, to find the manifests including a rendition.
+    filter_specs = models.TextField()
+    # JSON list of [url, width, height, format, file size].
+    records = models.TextField()
+
+    class Meta:
+        unique_together = (
+            ('image', 'focal_point_key', 'specs_hash'),
+        )
+
+    def __str__(self):
+        return f"{self.specs_hash} for image {self.image_id}"
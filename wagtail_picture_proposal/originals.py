@@ -0,0 +1,126 @@
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from willow.image import Image as WillowImage
+
+from wagtail.images.models import SourceImageIOError
+
+from wagtail_picture_proposal.locks import file_lock
+
+
+def get_originals_cache_dir():
+    """
+    Directory of local copies of original images kept in remote storage, set with
+    ``WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_DIR``. Disabled by default.
+    """
+    cache_dir = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_DIR', None)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_originals_cache_size():
+    return getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_SIZE', 1024 * 1024 * 1024)
+
+
+def get_file_hash(image):
+    """
+    Hash identifying the content of the image’s file: Wagtail’s file_hash, or a hash of the file name
+    for images uploaded without one, as replacing the file of an image changes its name.
+    """
+    return image.file_hash or hashlib.sha1(image.file.name.encode('utf-8')).hexdigest()
+
+
+def get_original_key(image):
+    # Keyed on the content, so replacing the file of an image never serves the previous one.
+    return get_file_hash(image) + os.path.splitext(image.file.name)[1].lower()
+
+
+def evict_originals(cache_dir, max_size, keep):
+    """
+    Delete the least recently used originals until the cache fits in ``max_size`` bytes.
+    Recency is the modification time, updated on each use.
+    """
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            # Skip files being downloaded.
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # Evicted by another process, or open on Windows.
+            pass
+        total -= size
+
+
+def fetch_original(image, cache_dir):
+    """
+    Open the local copy of the image’s original file, downloading it from the storage if needed.
+    Concurrent fetches of the same original, from threads or processes, wait for a single download.
+    """
+    key = get_original_key(image)
+    path = os.path.join(cache_dir, key)
+
+    with file_lock(f"original-{key}"):
+        if not os.path.exists(path):
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.')
+            try:
+                with os.fdopen(fd, 'wb') as f, image.open_file() as source:
+                    shutil.copyfileobj(source, f, 1024 * 1024)
+                # Atomic, so other processes never read a partial file.
+                os.replace(temp_path, path)
+            except IOError as e:
+                raise SourceImageIOError(str(e))
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        os.utime(path)
+        # Opened while holding the lock, so the file stays readable if another process evicts it.
+        f = open(path, 'rb')
+
+    evict_originals(cache_dir, get_originals_cache_size(), keep=path)
+    return f
+
+
+@contextmanager
+def open_original(image):
+    """
+    Like Wagtail’s Image.get_willow_image, but reading files from a local path memory-mapped,
+    with originals in remote storage first copied to ``WAGTAIL_PICTURE_PROPOSAL_ORIGINALS_CACHE_DIR``
+    so they are only downloaded once, whatever the number of renditions.
+    """
+    if image.is_stored_locally():
+        try:
+            f = open(image.file.path, 'rb')
+        except IOError as e:
+            raise SourceImageIOError(str(e))
+    else:
+        cache_dir = get_originals_cache_dir()
+        if not cache_dir:
+            with image.get_willow_image() as willow:
+                yield willow
+            return
+        f = fetch_original(image, cache_dir)
+
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield WillowImage.open(f)
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield WillowImage.open(data)
@@ -0,0 +1,116 @@
+import threading
+
+from debug_toolbar.panels import Panel
+
+from wagtail_picture_proposal.signals import renditions_generated, renditions_served, tag_rendered
+
+
+class RenditionsPanel(Panel):
+    """
+    django-debug-toolbar panel listing the picture tags rendered for the request,
+    with the tier which served each rendition, and the cost of generating missing ones.
+
+    Add ``"wagtail_picture_proposal.panels.RenditionsPanel"`` to ``DEBUG_TOOLBAR_PANELS`` to use it.
+    """
+
+    title = "Renditions"
+    template = 'wagtail_picture_proposal/panels/renditions.html'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.thread_id = None
+        self.tags = []
+        self.reset_pending()
+
+    def reset_pending(self):
+        # Renditions served since the last tag was rendered, keyed by filter spec.
+        self.pending_image = None
+        self.pending_renditions = {}
+        self.pending_generation_ms = 0
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return ""
+        return (
+            f"{len(stats['tags'])} tags, {stats['generated']} renditions generated "
+            f"in {stats['generation_ms']:.0f}ms"
+        )
+
+    def enable_instrumentation(self):
+        # Signals are sent from all threads, only record those of the request.
+        self.thread_id = threading.get_ident()
+        renditions_served.connect(self.record_served)
+        renditions_generated.connect(self.record_generated)
+        tag_rendered.connect(self.record_tag)
+
+    def disable_instrumentation(self):
+        renditions_served.disconnect(self.record_served)
+        renditions_generated.disconnect(self.record_generated)
+        tag_rendered.disconnect(self.record_tag)
+
+    def get_pending_rendition(self, spec):
+        return self.pending_renditions.setdefault(spec, {
+            'spec': spec,
+            'tier': None,
+            'format': None,
+            'size': None,
+            'encode_ms': None,
+        })
+
+    def record_served(self, image, tiers, **kwargs):
+        if threading.get_ident() != self.thread_id:
+            return
+        self.pending_image = image
+        for spec, tier in tiers.items():
+            self.get_pending_rendition(spec)['tier'] = tier
+
+    def record_generated(self, image, duration, renditions, **kwargs):
+        if threading.get_ident() != self.thread_id:
+            return
+        self.pending_image = image
+        self.pending_generation_ms += duration * 1000
+        for spec, format, size, encode_time in renditions:
+            rendition = self.get_pending_rendition(spec)
+            rendition['format'] = format
+            rendition['size'] = size
+            rendition['encode_ms'] = encode_time * 1000 if encode_time is not None else None
+
+    def record_tag(self, node, duration, **kwargs):
+        if threading.get_ident() != self.thread_id:
+            return
+        origin = getattr(node, 'origin', None)
+        token = getattr(node, 'token', None)
+        self.add_tag(
+            tag_name=node.tag_name,
+            template_name=origin.template_name if origin is not None else None,
+            line=token.lineno if token is not None else None,
+            duration=duration,
+        )
+
+    def add_tag(self, tag_name, template_name, line, duration):
+        self.tags.append({
+            'tag_name': tag_name,
+            'template_name': template_name,
+            'line': line,
+            'image': str(self.pending_image) if self.pending_image is not None else None,
+            'image_id': self.pending_image.pk if self.pending_image is not None else None,
+            'duration_ms': duration * 1000 if duration is not None else None,
+            'generation_ms': self.pending_generation_ms,
+            'renditions': list(self.pending_renditions.values()),
+        })
+        self.reset_pending()
+
+    def generate_stats(self, request, response):
+        if self.pending_renditions:
+            # Renditions fetched outside of the tags, e.g. by views.
+            self.add_tag(tag_name=None, template_name=None, line=None, duration=None)
+
+        self.record_stats({
+            'tags': self.tags,
+            'generated': sum(
+                1 for tag in self.tags for rendition in tag['renditions'] if rendition['tier'] == 'generated'
+            ),
+            'generation_ms': sum(tag['generation_ms'] for tag in self.tags),
+        })
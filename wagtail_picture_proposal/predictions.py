@@ -0,0 +1,76 @@
+import os.path
+
+from django.conf import settings
+
+from wagtail_picture_proposal.cache import RenditionRecord
+from wagtail_picture_proposal.processing import get_output_format, predict_size
+
+
+# A mapping of image formats to extensions
+FORMAT_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'gif': '.gif',
+    'webp': '.webp',
+}
+
+
+def get_rendition_filename(image, filter_spec, focal_point_key, format_name):
+    """
+    File name of a rendition, as Wagtail names them, before it's passed to the storage.
+    """
+    input_filename = os.path.basename(image.file.name)
+    input_filename_without_extension, input_extension = os.path.splitext(input_filename)
+
+    output_extension = filter_spec.replace('|', '.') + FORMAT_EXTENSIONS[format_name]
+    if focal_point_key:
+        output_extension = focal_point_key + '.' + output_extension
+
+    # Truncate filename to prevent it going over 60 chars
+    output_filename_without_extension = input_filename_without_extension[:(59 - len(output_extension))]
+    return output_filename_without_extension + '.' + output_extension
+
+
+def predict_rendition_name(image, filter):
+    """
+    Storage name a rendition will be saved under, unless that name is already taken in the storage.
+    """
+    Rendition = image.get_rendition_model()
+    filename = get_rendition_filename(image, filter.spec, filter.get_cache_key(image), get_output_format(image, filter))
+    return Rendition._meta.get_field('file').generate_filename(Rendition(image=image), filename)
+
+
+def predict_rendition_url(image, filter):
+    Rendition = image.get_rendition_model()
+    return Rendition._meta.get_field('file').storage.url(predict_rendition_name(image, filter))
+
+
+def get_predicted_urls():
+    """
+    URLs used for renditions generated in the background, set with ``WAGTAIL_PICTURE_PROPOSAL_PREDICTED_URLS``:
+    None for a stand-in (default), "storage" for the URL the file will be saved at,
+    or "serve" for Wagtail’s ``wagtailimages_serve`` view, which generates the rendition when requested.
+    """
+    mode = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_PREDICTED_URLS', None)
+    if mode not in (None, 'storage', 'serve'):
+        raise ValueError(f"WAGTAIL_PICTURE_PROPOSAL_PREDICTED_URLS should be None, 'storage' or 'serve', got {mode!r}")
+    return mode
+
+
+def predict_rendition_record(image, filter, url=None):
+    """
+    Record of a rendition before it's generated: predicted dimensions and format, and the URL
+    from ``WAGTAIL_PICTURE_PROPOSAL_PREDICTED_URLS``, unless given.
+    Falls back to the source dimensions for filters which can't be predicted.
+    """
+    if url is None:
+        if get_predicted_urls() == 'serve':
+            # Imported here as the view module loads the image model.
+            from wagtail.images.views.serve import generate_image_url
+
+            url = generate_image_url(image, filter.spec)
+        else:
+            url = predict_rendition_url(image, filter)
+
+    width, height = predict_size(image, filter) or (image.width, image.height)
+    return RenditionRecord(url, width, height, get_output_format(image, filter), placeholder=True)
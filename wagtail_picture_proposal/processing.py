@@ -0,0 +1,515 @@
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import django
+from django.apps import apps
+from django.conf import settings
+from PIL import Image as PILImage
+from willow.image import GIFImageFile, JPEGImageFile, PNGImageFile, WebPImageFile
+from willow.plugins.pillow import PillowImage
+
+from wagtail.images.image_operations import (
+    FormatOperation,
+    JPEGQualityOperation,
+    MinMaxOperation,
+    ScaleOperation,
+    WebPQualityOperation,
+    WidthHeightOperation,
+)
+
+from wagtail_picture_proposal.cache import get_file_format
+from wagtail_picture_proposal.originals import open_original
+
+
+# Operations which only set encoder options in `env`, and never touch pixels.
+ENCODER_OPERATIONS = (FormatOperation, JPEGQualityOperation, WebPQualityOperation)
+# Operations which resize while preserving the aspect ratio,
+# and can therefore start from any larger intermediate.
+RESIZE_OPERATIONS = (MinMaxOperation, WidthHeightOperation, ScaleOperation)
+
+# Willow output classes, to rebuild generated images returned by worker processes.
+OUTPUT_FORMATS = {
+    'jpeg': JPEGImageFile,
+    'png': PNGImageFile,
+    'gif': GIFImageFile,
+    'webp': WebPImageFile,
+}
+
+_executor = None
+_executor_config = None
+_executor_lock = threading.Lock()
+
+
+# Pixel modes supported by Pillow’s Image.reduce.
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBa', 'La', 'I', 'F')
+
+EXIF_ORIENTATION = 0x0112
+
+
+class SizeProbe:
+    """
+    Stands in for a Willow image within pixel operations, so the size they produce
+    can be worked out from the source dimensions without touching any pixels.
+    Also tracks the scale relative to the source, and the largest scale resized to along the operations.
+    Any method added here needs adding to ReducedImage as well.
+    """
+
+    def __init__(self, size, scale=1, max_scale=0):
+        self.size = size
+        self.scale = scale
+        self.max_scale = max_scale
+
+    def get_size(self):
+        return self.size
+
+    def resize(self, size):
+        scale = self.scale * max(size[0] / self.size[0], size[1] / self.size[1])
+        return SizeProbe(size, scale, max(self.max_scale, scale))
+
+    def crop(self, rect):
+        left, top, right, bottom = rect
+        width, height = self.size
+        size = (min(right, width) - max(left, 0), min(bottom, height) - max(top, 0))
+        return SizeProbe(size, self.scale, self.max_scale)
+
+    def set_background_color_rgb(self, color):
+        return self
+
+
+class ReducedImage:
+    """
+    A source image decoded at a reduced size, presenting the dimensions of the full-size image,
+    so operations work out crops and focal points in full-size coordinates.
+    Resizing returns a regular Willow image of the requested size.
+
+    Only the methods of SizeProbe are supported, so operations calling any other method
+    fail to probe, and get_decode_scale decodes their source at full size.
+    """
+
+    def __init__(self, willow, size):
+        self.willow = willow
+        self.size = size
+
+    def get_size(self):
+        return self.size
+
+    def crop(self, rect):
+        left, top, right, bottom = rect
+        width, height = self.size
+        reduced_width, reduced_height = self.willow.get_size()
+        x_scale = reduced_width / width
+        y_scale = reduced_height / height
+
+        cropped = self.willow.crop((
+            round(left * x_scale),
+            round(top * y_scale),
+            max(round(right * x_scale), round(left * x_scale) + 1),
+            max(round(bottom * y_scale), round(top * y_scale) + 1),
+        ))
+        size = (min(right, width) - max(left, 0), min(bottom, height) - max(top, 0))
+        return ReducedImage(cropped, size)
+
+    def resize(self, size):
+        return self.willow.resize(size)
+
+    def set_background_color_rgb(self, color):
+        return ReducedImage(self.willow.set_background_color_rgb(color), self.size)
+
+
+class RenditionGroup:
+    """
+    Renditions sharing the same pixel operations, which only differ in their output format / quality.
+    """
+
+    def __init__(self, pixel_operations):
+        self.pixel_operations = pixel_operations
+        # List of (index in the filters list, encoder operations).
+        self.outputs = []
+
+    @property
+    def is_resize(self):
+        return len(self.pixel_operations) == 1 and isinstance(self.pixel_operations[0], RESIZE_OPERATIONS)
+
+    def target_size(self, image, source_size):
+        probe = self.pixel_operations[0].run(SizeProbe(source_size), image, {})
+        return probe.size if probe else source_size
+
+
+def get_output_format(image, filter):
+    """
+    The format ``Filter.run`` would save the rendition as, worked out without opening the source image.
+    """
+    env = {}
+    for operation in filter.operations:
+        if isinstance(operation, ENCODER_OPERATIONS):
+            operation.run(None, image, env)
+
+    if 'output-format' in env:
+        return env['output-format']
+
+    # Assume GIFs aren't animated, as that can only be known by opening the file.
+    default_conversions = {
+        'bmp': 'png',
+        'webp': 'png',
+        'gif': 'png',
+    }
+    default_conversions.update(getattr(settings, 'WAGTAILIMAGES_FORMAT_CONVERSIONS', {}))
+    original_format = get_file_format(image.file.name)
+    return default_conversions.get(original_format, original_format)
+
+
+def probe_operations(image, operations, source_size):
+    """
+    Run pixel operations on a SizeProbe of the source size.
+    Returns None when an operation needs more than the probe provides, e.g. custom operations.
+    """
+    probe = SizeProbe(source_size)
+    try:
+        for operation in operations:
+            probe = operation.run(probe, image, {}) or probe
+    except Exception:
+        return None
+    return probe
+
+
+def predict_size(image, filter):
+    """
+    Size of a rendition, worked out from the stored dimensions and focal point of the source image,
+    the same way the operations of the filter would resize and crop it.
+    Returns None if the filter has operations which can't be predicted.
+
+    Wagtail stores the dimensions of the file before EXIF orientation is applied,
+    so predictions are transposed for JPEGs rotated by a quarter turn.
+    """
+    pixel_operations = [
+        operation for operation in filter.operations if not isinstance(operation, ENCODER_OPERATIONS)
+    ]
+    probe = probe_operations(image, pixel_operations, (image.width, image.height))
+    return probe.size if probe else None
+
+
+def get_decode_scale(image, groups, source_size):
+    """
+    The smallest scale the source image can be decoded at, so that every rendition is still resized down
+    from at least ``WAGTAIL_PICTURE_PROPOSAL_DECODE_OVERSAMPLING`` times its size (default 2, 0 to disable).
+    Returns 1 to decode at full size, when any rendition isn’t a downscale or can’t be worked out in advance.
+    """
+    oversampling = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_DECODE_OVERSAMPLING', 2)
+    if not oversampling:
+        return 1
+
+    scale = 0
+    for group in groups:
+        probe = probe_operations(image, group.pixel_operations, source_size)
+        if probe is None:
+            return 1
+        scale = max(scale, probe.scale, probe.max_scale)
+
+    return min(1, scale * oversampling)
+
+
+def decode_source(image_file, image, groups):
+    """
+    Decode the source image and fix its orientation. When all renditions are much smaller than the source,
+    JPEGs are decoded at a reduced size with DCT scaling (Pillow’s draft mode), and PNG / WebP images are
+    reduced straight after decoding. Reduced images are wrapped in ReducedImage so operations keep
+    working out crops and focal points in full-size coordinates.
+
+    :return: (Willow image, full size of the oriented source)
+    """
+    if not isinstance(image_file, (JPEGImageFile, PNGImageFile, WebPImageFile)):
+        willow = image_file.auto_orient()
+        return willow, willow.get_size()
+
+    image_file.f.seek(0)
+    pil_image = PILImage.open(image_file.f)
+    original_size = pil_image.size
+
+    # The orientation is only needed to estimate the scale, the actual size is checked after auto_orient.
+    if pil_image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+        scale = get_decode_scale(image, groups, original_size[::-1])
+    else:
+        scale = get_decode_scale(image, groups, original_size)
+
+    if scale < 1 and pil_image.format == 'JPEG':
+        # Pillow picks the smallest DCT scale (1/2, 1/4 or 1/8) still at least as large as requested.
+        pil_image.draft(pil_image.mode, (math.ceil(original_size[0] * scale), math.ceil(original_size[1] * scale)))
+    decoded_size = pil_image.size
+    pil_image.load()
+
+    willow = PillowImage(pil_image).auto_orient()
+    oriented_size = willow.get_size()
+    full_size = original_size if oriented_size == decoded_size else original_size[::-1]
+
+    factor = int(1 / scale)
+    if pil_image.format != 'JPEG' and factor >= 2 and willow.image.mode in REDUCIBLE_MODES:
+        willow = PillowImage(willow.image.reduce(factor))
+
+    if willow.get_size() != full_size:
+        willow = ReducedImage(willow, full_size)
+    return willow, full_size
+
+
+def group_filters(filters):
+    groups = {}
+    for i, filter in enumerate(filters):
+        pixel_specs = []
+        pixel_operations = []
+        encoder_operations = []
+        for op_spec, operation in zip(filter.spec.split('|'), filter.operations):
+            if isinstance(operation, ENCODER_OPERATIONS):
+                encoder_operations.append(operation)
+            else:
+                pixel_specs.append(op_spec)
+                pixel_operations.append(operation)
+
+        group = groups.setdefault(tuple(pixel_specs), RenditionGroup(pixel_operations))
+        group.outputs.append((i, encoder_operations))
+    return list(groups.values())
+
+
+def copy_willow(willow):
+    if isinstance(willow, PillowImage):
+        return PillowImage(willow.image.copy())
+    return willow
+
+
+def encode(willow, env, output):
+    """
+    Save the image in the format picked from `env`, with the same rules as ``Filter.run``.
+    """
+    original_format = env['original-format']
+
+    if 'output-format' in env:
+        # Developer specified an output format
+        output_format = env['output-format']
+    else:
+        # Convert bmp and webp to png by default
+        default_conversions = {
+            'bmp': 'png',
+            'webp': 'png',
+        }
+
+        # Convert unanimated GIFs to PNG as well
+        if not willow.has_animation():
+            default_conversions['gif'] = 'png'
+
+        # Allow the user to override the conversions
+        conversion = getattr(settings, 'WAGTAILIMAGES_FORMAT_CONVERSIONS', {})
+        default_conversions.update(conversion)
+
+        # Get the converted output format falling back to the original
+        output_format = default_conversions.get(original_format, original_format)
+
+    if output_format == 'jpeg':
+        # Allow changing of JPEG compression quality
+        if 'jpeg-quality' in env:
+            quality = env['jpeg-quality']
+        else:
+            quality = getattr(settings, 'WAGTAILIMAGES_JPEG_QUALITY', 85)
+
+        # If the image has an alpha channel, give it a white background
+        if willow.has_alpha():
+            willow = willow.set_background_color_rgb((255, 255, 255))
+
+        return willow.save_as_jpeg(output, quality=quality, progressive=True, optimize=True)
+    elif output_format == 'png':
+        return willow.save_as_png(output, optimize=True)
+    elif output_format == 'gif':
+        return willow.save_as_gif(output)
+    elif output_format == 'webp':
+        # Allow changing of WebP compression quality
+        if 'output-format-options' in env and 'lossless' in env['output-format-options']:
+            return willow.save_as_webp(output, lossless=True)
+        elif 'webp-quality' in env:
+            quality = env['webp-quality']
+        else:
+            quality = getattr(settings, 'WAGTAILIMAGES_WEBP_QUALITY', 85)
+
+        return willow.save_as_webp(output, quality=quality)
+
+
+def get_executor():
+    """
+    Return the shared worker pool configured with ``WAGTAIL_PICTURE_PROPOSAL_RENDITION_WORKERS``
+    and ``WAGTAIL_PICTURE_PROPOSAL_RENDITION_EXECUTOR`` ("thread" or "process"),
+    or None to generate renditions on the calling thread.
+    """
+    global _executor, _executor_config
+
+    workers = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_RENDITION_WORKERS', 1)
+    kind = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_RENDITION_EXECUTOR', 'thread')
+    if not workers or workers <= 1:
+        return None
+
+    if kind not in ('thread', 'process'):
+        raise ValueError(f"WAGTAIL_PICTURE_PROPOSAL_RENDITION_EXECUTOR should be 'thread' or 'process', got {kind!r}")
+
+    # Daemonic processes (e.g. multiprocessing pool workers) cannot have children.
+    if kind == 'process' and multiprocessing.current_process().daemon:
+        kind = 'thread'
+
+    with _executor_lock:
+        if _executor_config != (kind, workers):
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            if kind == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=setup_worker_process)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='renditions')
+            _executor_config = (kind, workers)
+        return _executor
+
+
+def setup_worker_process():
+    # Worker processes started with "spawn" rather than "fork" need to load Django themselves.
+    if not apps.ready:
+        django.setup()
+
+
+def run_inline(fn, *args):
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def resize_pixels(base_future, target_size):
+    return base_future.result().resize(target_size)
+
+
+def apply_pixel_operations(source_future, image, pixel_operations):
+    pixels = source_future.result()
+    for operation in pixel_operations:
+        pixels = operation.run(pixels, image, {}) or pixels
+    return pixels
+
+
+def encode_output(pixels_future, image, original_format, encoder_operations):
+    """
+    Returns the generated image, and the time spent encoding it in seconds.
+    """
+    pixels = pixels_future.result()
+    start = time.perf_counter()
+    if isinstance(pixels, ReducedImage):
+        # Only when a rendition is the full source size, which get_decode_scale avoids.
+        pixels = pixels.resize(pixels.get_size())
+    env = {
+        'original-format': original_format,
+    }
+    for operation in encoder_operations:
+        operation.run(pixels, image, env)
+
+    # Each encoder gets its own copy of the shared pixels.
+    return encode(copy_willow(pixels), env, BytesIO()), time.perf_counter() - start
+
+
+def run_pipeline(image, filters, executor=None, timings=None):
+    generated_images = [None] * len(filters)
+    groups = group_filters(filters)
+
+    # Work is submitted in dependency order: a task only ever waits on tasks submitted before it,
+    # so the pool cannot deadlock however few workers it has.
+    def submit(fn, *args):
+        if executor is None:
+            return run_inline(fn, *args)
+        return executor.submit(fn, *args)
+
+    with open_original(image) as image_file:
+        original_format = image_file.format_name
+
+        # Fix orientation of image, decoding it at a reduced size when possible.
+        willow, source_size = decode_source(image_file, image, groups)
+        source = run_inline(lambda: willow)
+
+        # Resize-only groups are processed largest first, so smaller ones can reuse their output.
+        intermediates = [(source_size, source)]
+        resize_groups = [(group.target_size(image, source_size), group) for group in groups if group.is_resize]
+        resize_groups.sort(key=lambda item: item[0][0] * item[0][1], reverse=True)
+
+        group_pixels = []
+        for target_size, group in resize_groups:
+            # Upscales start from the source.
+            base_size, base = min(
+                (item for item in intermediates if item[0][0] >= target_size[0] and item[0][1] >= target_size[1]),
+                key=lambda item: item[0][0] * item[0][1],
+                default=(source_size, source),
+            )
+            pixels = base if base_size == target_size else submit(resize_pixels, base, target_size)
+            intermediates.append((target_size, pixels))
+            group_pixels.append((group, pixels))
+
+        for group in groups:
+            if not group.is_resize:
+                group_pixels.append((group, submit(apply_pixel_operations, source, image, group.pixel_operations)))
+
+        outputs = []
+        for group, pixels in group_pixels:
+            for i, encoder_operations in group.outputs:
+                outputs.append((i, submit(encode_output, pixels, image, original_format, encoder_operations)))
+
+        for i, output in outputs:
+            generated_images[i], encode_time = output.result()
+            if timings is not None:
+                timings[i] = encode_time
+
+    return generated_images
+
+
+def run_pipeline_encoded(image, specs):
+    """
+    Worker process entry point: generate renditions for the given specs,
+    returning (format_name, bytes, encode time) tuples which can be sent back to the parent process.
+    """
+    from wagtail.images.models import Filter
+
+    timings = [None] * len(specs)
+    generated_images = run_pipeline(image, [Filter(spec=spec) for spec in specs], timings=timings)
+    return [
+        (generated_image.format_name, generated_image.f.getvalue(), encode_time)
+        for generated_image, encode_time in zip(generated_images, timings)
+    ]
+
+
+def generate_renditions(image, filters, timings=None):
+    """
+    Like running ``filter.run(image, BytesIO())`` for each filter, but decoding the source image only once.
+    Renditions which only differ in output format share their orientation / crop / resize work,
+    and resize-only renditions start from the nearest larger intermediate.
+    With a worker pool configured, resizes and encodes run concurrently.
+
+    :param image: AbstractImage
+    :param filters: list of Filter
+    :param timings: optional list as long as filters, filled with the seconds spent encoding each rendition
+    :return: list of generated Willow images, in the same order as filters
+    """
+    executor = get_executor()
+
+    if not isinstance(executor, ProcessPoolExecutor) or len(filters) < 2:
+        return run_pipeline(image, filters, executor, timings)
+
+    # Pixels can't be shared across processes, so split groups of renditions between workers,
+    # each of which decodes the source once for its share.
+    generated_images = [None] * len(filters)
+    workers = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_RENDITION_WORKERS', 1)
+    chunks = [[] for i in range(workers)]
+    for i, group in enumerate(group_filters(filters)):
+        chunks[i % len(chunks)].extend(index for index, encoder_operations in group.outputs)
+
+    futures = [
+        (chunk, executor.submit(run_pipeline_encoded, image, [filters[i].spec for i in chunk]))
+        for chunk in chunks if chunk
+    ]
+    for chunk, future in futures:
+        for i, (format_name, data, encode_time) in zip(chunk, future.result()):
+            generated_images[i] = OUTPUT_FORMATS[format_name](BytesIO(data))
+            if timings is not None:
+                timings[i] = encode_time
+
+    return generated_images
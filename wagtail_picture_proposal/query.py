@@ -0,0 +1,60 @@
+from django.db.models.query import ModelIterable
+
+from wagtail_picture_proposal.breakpoints import expand_breakpoints
+from wagtail_picture_proposal.shortcuts import get_renditions_for_images
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters
+from wagtail_picture_proposal.templatetags.wagtailpictureproposal_tags import (
+    compile_picture_filters,
+    extract_native_format,
+    parse_picture_options,
+)
+
+
+def prefetch_renditions(images, *filter_specs, picture=False):
+    """
+    Fetch the renditions the tags need for a list of images in one go, e.g. images from StreamField blocks.
+    Takes the same filter specs as the tags, with ``picture=True`` for those of ``webp_picture_wip``.
+    """
+    if picture:
+        source_filter_specs, specified_format, quality = parse_picture_options(filter_specs)
+        source_filter_specs = compile_filter_specs(tuple(source_filter_specs))
+
+        def filters(image):
+            return compile_picture_filters(
+                expand_breakpoints(image, source_filter_specs), extract_native_format(image), specified_format, quality,
+            )
+    else:
+        specs = compile_filter_specs(filter_specs)
+
+        def filters(image):
+            return compile_filters(expand_breakpoints(image, specs))
+
+    get_renditions_for_images(images, filters)
+
+
+class RenditionsQuerySetMixin:
+    """
+    Adds ``prefetch_renditions`` to the queryset of a custom image model, fetching the renditions
+    of all images along with them, like ``prefetch_related``:
+    ``CustomImage.objects.prefetch_renditions("width-{320,640}")``.
+    """
+
+    _prefetch_rendition_specs = None
+    _prefetch_renditions_done = False
+
+    def prefetch_renditions(self, *filter_specs, picture=False):
+        clone = self._chain()
+        clone._prefetch_rendition_specs = (filter_specs, picture)
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._prefetch_rendition_specs = self._prefetch_rendition_specs
+        return clone
+
+    def _fetch_all(self):
+        super()._fetch_all()
+        if self._prefetch_rendition_specs and not self._prefetch_renditions_done and self._iterable_class is ModelIterable:
+            filter_specs, picture = self._prefetch_rendition_specs
+            prefetch_renditions(self._result_cache, *filter_specs, picture=picture)
+            self._prefetch_renditions_done = True
@@ -1,78 +1,273 @@
 from django.core.cache import InvalidCacheBackendError, caches
-import os.path
-from io import BytesIO
+import time
 from django.core.files import File
-from django.db.models import Q
+from django.db.models import OuterRef, Q, Subquery
 
 from wagtail.images.models import Filter, SourceImageIOError
 
+from wagtail_picture_proposal.background import enqueue_renditions, get_background_mode, get_placeholder_record
+from wagtail_picture_proposal.cache import RenditionRecord, get_rendition_lru
+from wagtail_picture_proposal.locks import get_single_flight, rendition_lock
+from wagtail_picture_proposal.manifests import get_manifest, get_manifests_enabled, invalidate_manifests, save_manifest
+from wagtail_picture_proposal.predictions import get_rendition_filename
+from wagtail_picture_proposal.processing import generate_renditions
+from wagtail_picture_proposal.signals import renditions_generated, renditions_served
 
-def image_get_renditions(image, filters):
+
+def image_get_renditions(image, filters, generate=True):
+    """
+    Like Wagtail’s own Image.get_rendition, but for multiple renditions at once.
+    With generate=False, renditions missing from the cache and database are returned as None.
+    """
     self = image
     filters = [Filter(spec=f) if isinstance(f, str) else f for f in filters]
     cache_keys = [f.get_cache_key(self) for f in filters]
     rendition_params = list(zip(filters, cache_keys))
     Rendition = self.get_rendition_model()
 
-    rendition_cache_keys = []
+    rendition_cache_keys = [
+        Rendition.construct_cache_key(self.id, cache_key, filter.spec)
+        for filter, cache_key in rendition_params
+    ]
+
+    # Renditions attached to the image by get_renditions_for_images.
+    prefetched_renditions = getattr(self, '_prefetched_renditions', {})
+    cached_renditions = {
+        rendition_cache_key: prefetched_renditions[rendition_cache_key]
+        for rendition_cache_key in rendition_cache_keys
+        if rendition_cache_key in prefetched_renditions
+    }
+    if renditions_served.has_listeners() and len(cached_renditions) > 0:
+        send_renditions_served(self, {
+            filter.spec: 'prefetch' for (filter, cache_key), rendition_cache_key in zip(rendition_params, rendition_cache_keys)
+            if rendition_cache_key in cached_renditions
+        })
+    if len(cached_renditions) == len(rendition_cache_keys):
+        return [cached_renditions[rendition_cache_key] for rendition_cache_key in rendition_cache_keys]
 
+    # Fetch all cached renditions in a single round-trip.
     try:
         rendition_caching = True
         cache = caches['renditions']
-        cached_renditions = []
-        for filter, cache_key in rendition_params:
-            rendition_cache_key = Rendition.construct_cache_key(
-                self.id,
-                cache_key,
-                filter.spec
-            )
-            rendition_cache_keys.append(rendition_cache_key)
-            cached_rendition = cache.get(rendition_cache_key)
-            if cached_rendition:
-                cached_renditions.append(cached_rendition)
-        return cached_renditions
+        shared_renditions = cache.get_many([key for key in rendition_cache_keys if key not in cached_renditions])
     except InvalidCacheBackendError:
         rendition_caching = False
+        shared_renditions = {}
+
+    cached_renditions.update(shared_renditions)
+
+    lookup_params = {
+        rendition_cache_key: params for params, rendition_cache_key in zip(rendition_params, rendition_cache_keys)
+        if rendition_cache_key not in cached_renditions
+    }
+    if renditions_served.has_listeners() and len(shared_renditions) > 0:
+        send_renditions_served(self, {
+            filter.spec: 'cache' for (filter, cache_key), rendition_cache_key in zip(rendition_params, rendition_cache_keys)
+            if rendition_cache_key in shared_renditions
+        })
+    if len(lookup_params) == 0:
+        return [cached_renditions[rendition_cache_key] for rendition_cache_key in rendition_cache_keys]
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        fetched_renditions = fetch_renditions(self, list(lookup_params.values()), generate)
+    else:
+        # Threads needing the same renditions at the same time share a single lookup and generation.
+        # Lookups without generation are kept apart, as their result can be missing renditions.
+        own_keys = set()
+
+        def fetch(flight_keys):
+            own_keys.update(flight_keys)
+            renditions = fetch_renditions(self, [lookup_params[key] for key, _ in flight_keys], generate)
+            return {(key, generate): renditions.get(key) for key, _ in flight_keys}
+
+        results = single_flight.run([(key, generate) for key in lookup_params], fetch)
+        fetched_renditions = {key: rendition for (key, _), rendition in results.items() if rendition is not None}
+
+        if renditions_served.has_listeners() and len(own_keys) < len(results):
+            send_renditions_served(self, {
+                lookup_params[key][0].spec: 'single-flight' for key, _ in results if (key, generate) not in own_keys
+            })
+
+    if rendition_caching:
+        # Write back everything the cache didn’t have, in a single round-trip.
+        cache.set_many(fetched_renditions)
+
+    # Keep the same order as the filters.
+    return [
+        cached_renditions.get(rendition_cache_key) or fetched_renditions.get(rendition_cache_key)
+        for rendition_cache_key in rendition_cache_keys
+    ]
+
+
+def fetch_renditions(image, rendition_params, generate=True):
+    """
+    Get renditions from the database, and generate the missing ones if generate is True.
+
+    :param rendition_params: list of (Filter, focal point cache key)
+    :return: dict of renditions, keyed by rendition cache key
+    """
+    self = image
+    Rendition = self.get_rendition_model()
 
     # We need to get renditions that have both attributes matching in pairs.
-    q_objects = Q()
-    for filter, cache_key in rendition_params:
-        q_objects |= Q(filter_spec=filter.spec, focal_point_key=cache_key)
-    renditions = list(self.renditions.filter(q_objects))
+    renditions = list(with_file_sizes(self.renditions.filter(get_renditions_q(rendition_params))))
+    fill_file_sizes(renditions)
 
     # TODO-DONE This should only create renditions that don’t exist.
     created_renditions = []
-    missing_rendition_params = []
+    found_keys = {(rendition.filter_spec, rendition.focal_point_key) for rendition in renditions}
+    # Filters repeated in the list are only generated once.
+    missing_rendition_params = list({
+        (filter.spec, cache_key): (filter, cache_key) for filter, cache_key in rendition_params
+        if (filter.spec, cache_key) not in found_keys
+    }.values())
+    if generate and len(missing_rendition_params) > 0:
+        created_renditions = create_renditions(self, missing_rendition_params)
+
+    if renditions_served.has_listeners():
+        tiers = {rendition.filter_spec: 'db' for rendition in renditions}
+        tiers.update((filter.spec, None) for filter, cache_key in missing_rendition_params)
+        tiers.update((rendition.filter_spec, 'generated') for rendition in created_renditions)
+        send_renditions_served(self, tiers)
+
+    renditions.extend(created_renditions)
+    return {
+        Rendition.construct_cache_key(self.id, rendition.focal_point_key, rendition.filter_spec): rendition
+        for rendition in renditions
+    }
+
+
+def get_renditions_q(rendition_params):
+    """
+    Match the renditions of (filter, focal point cache key) pairs, with one ``IN`` list of filter specs
+    per focal point key rather than a condition per pair. All filters of an image using the focal point
+    share the same key, so this stays a couple of conditions however many specs there are,
+    which the unique index on (image, filter_spec, focal_point_key) covers.
+    """
+    specs_by_key = {}
     for filter, cache_key in rendition_params:
-        if len([r for r in renditions if r.filter_spec == filter.spec and r.focal_point_key == cache_key]) == 0:
-            missing_rendition_params.append((filter, cache_key))
-    if len(missing_rendition_params) > 0:
+        specs_by_key.setdefault(cache_key, set()).add(filter.spec)
+
+    q_objects = Q()
+    for cache_key, specs in specs_by_key.items():
+        q_objects |= Q(focal_point_key=cache_key, filter_spec__in=sorted(specs))
+    return q_objects
+
+
+def get_rendition_keys_q(rendition_keys):
+    """
+    Like get_renditions_q, for (image id, filter spec, focal point key) of renditions of several images.
+    """
+    specs_by_key = {}
+    for image_id, filter_spec, focal_point_key in rendition_keys:
+        specs_by_key.setdefault((image_id, focal_point_key), set()).add(filter_spec)
+
+    q_objects = Q()
+    for (image_id, focal_point_key), specs in specs_by_key.items():
+        q_objects |= Q(image_id=image_id, focal_point_key=focal_point_key, filter_spec__in=sorted(specs))
+    return q_objects
+
+
+def with_file_sizes(renditions):
+    """
+    Annotate a queryset of renditions with ``picture_file_size``, the size of their file in bytes if known.
+    """
+    from wagtail_picture_proposal.models import RenditionFileSize
+
+    return renditions.annotate(picture_file_size=Subquery(
+        RenditionFileSize.objects.filter(
+            image_id=OuterRef('image_id'),
+            filter_spec=OuterRef('filter_spec'),
+            focal_point_key=OuterRef('focal_point_key'),
+        ).values('file_size')[:1]
+    ))
+
+
+def save_file_sizes(renditions, file_sizes):
+    """
+    Store the file sizes of renditions, replacing those of earlier renditions with the same spec.
+    """
+    from wagtail_picture_proposal.models import RenditionFileSize
+
+    if len(renditions) == 0:
+        return
+
+    RenditionFileSize.objects.filter(get_rendition_keys_q(
+        (rendition.image_id, rendition.filter_spec, rendition.focal_point_key) for rendition in renditions
+    )).delete()
+    RenditionFileSize.objects.bulk_create([
+        RenditionFileSize(
+            image_id=rendition.image_id,
+            filter_spec=rendition.filter_spec,
+            focal_point_key=rendition.focal_point_key,
+            file_size=file_size,
+        )
+        for rendition, file_size in zip(renditions, file_sizes)
+    ], ignore_conflicts=True)
+    for rendition, file_size in zip(renditions, file_sizes):
+        rendition.picture_file_size = file_size
+
+
+def fill_file_sizes(renditions):
+    """
+    Get from the storage and store the file sizes of renditions created without them,
+    e.g. by Wagtail’s own Image.get_rendition, so this only happens once per rendition.
+    """
+    renditions_without_size = []
+    file_sizes = []
+    for rendition in renditions:
+        if getattr(rendition, 'picture_file_size', None) is None:
+            try:
+                file_sizes.append(rendition.file.size)
+            except OSError:
+                continue
+            renditions_without_size.append(rendition)
+    save_file_sizes(renditions_without_size, file_sizes)
+
+
+def create_renditions(image, rendition_params):
+    """
+    Generate and save renditions, holding a cross-process lock on the image so concurrent workers
+    wait for each other’s result instead of generating the same renditions.
+
+    :param image: AbstractImage
+    :param rendition_params: list of (Filter, focal point cache key)
+    :return: list of saved renditions, possibly created by another worker
+    """
+    self = image
+    Rendition = self.get_rendition_model()
+
+    with rendition_lock(self):
+        # Another worker may have created some of the renditions while we waited for the lock.
+        existing_renditions = list(with_file_sizes(self.renditions.filter(get_renditions_q(rendition_params))))
+        existing_keys = {(r.filter_spec, r.focal_point_key) for r in existing_renditions}
+        missing_rendition_params = [
+            (filter, cache_key) for filter, cache_key in rendition_params
+            if (filter.spec, cache_key) not in existing_keys
+        ]
+        if len(missing_rendition_params) == 0:
+            return existing_renditions
+
         bulk_objs = []
         # TODO-DONE Currently only generates a single rendition.
-        for filter, cache_key in missing_rendition_params:
-            # Generate the rendition image
-            generated_image = filter.run(self, BytesIO())
-
-            # Generate filename
-            input_filename = os.path.basename(self.file.name)
-            input_filename_without_extension, input_extension = os.path.splitext(input_filename)
-
-            # A mapping of image formats to extensions
-            FORMAT_EXTENSIONS = {
-                'jpeg': '.jpg',
-                'png': '.png',
-                'gif': '.gif',
-                'webp': '.webp',
-            }
-
-            output_extension = filter.spec.replace('|', '.') + FORMAT_EXTENSIONS[generated_image.format_name]
-            if cache_key:
-                output_extension = cache_key + '.' + output_extension
-
-            # Truncate filename to prevent it going over 60 chars
-            output_filename_without_extension = input_filename_without_extension[:(59 - len(output_extension))]
-            output_filename = output_filename_without_extension + '.' + output_extension
-
+        # Generate all rendition images from a single decode of the source.
+        start = time.perf_counter()
+        timings = [None] * len(missing_rendition_params)
+        generated_images = generate_renditions(self, [filter for filter, cache_key in missing_rendition_params], timings)
+        if renditions_generated.has_listeners():
+            renditions_generated.send(
+                sender=self.__class__,
+                image=self,
+                duration=time.perf_counter() - start,
+                renditions=[
+                    (filter.spec, generated_image.format_name, len(generated_image.f.getvalue()), encode_time)
+                    for (filter, cache_key), generated_image, encode_time
+                    in zip(missing_rendition_params, generated_images, timings)
+                ],
+            )
+        for (filter, cache_key), generated_image in zip(missing_rendition_params, generated_images):
+            output_filename = get_rendition_filename(self, filter.spec, cache_key, generated_image.format_name)
             bulk_objs.append(Rendition(
                 image=self,
                 filter_spec=filter.spec,
@@ -80,20 +275,137 @@ def image_get_renditions(image, filters):
                 file=File(generated_image.f, name=output_filename),
             ))
 
-        created_renditions = list(Rendition.objects.bulk_create(bulk_objs))
+        # Renditions can still be created without the lock, e.g. by Wagtail’s own Image.get_rendition,
+        # so rely on the unique constraint to skip them.
+        Rendition.objects.bulk_create(bulk_objs, ignore_conflicts=True)
+        # Objects created with ignore_conflicts have no primary key, fetch the saved rows instead.
+        created_renditions = list(with_file_sizes(self.renditions.filter(get_renditions_q(missing_rendition_params))))
 
-    renditions.extend(created_renditions)
-    def rendition_position(rendition):
-        return [i for i, f in enumerate(filters) if f.spec == rendition.filter_spec]
-    renditions.sort(key=rendition_position)
+        # Record the size of the files we saved, known without asking the storage.
+        file_sizes = {
+            obj.file.name: len(generated_image.f.getvalue()) for obj, generated_image in zip(bulk_objs, generated_images)
+        }
+        saved_renditions = [rendition for rendition in created_renditions if rendition.file.name in file_sizes]
+        save_file_sizes(saved_renditions, [file_sizes[rendition.file.name] for rendition in saved_renditions])
 
-    if rendition_caching:
-        i = 0
-        for rendition_cache_key in rendition_cache_keys:
-            cache.set(rendition_cache_key, renditions[i])
-            i += 1
+        # Renditions created with bulk_create don’t send post_save, replace stale manifests here.
+        invalidate_manifests(self.pk, [(rendition.filter_spec, rendition.focal_point_key) for rendition in saved_renditions])
+
+    # Clean up files of renditions which lost a conflict.
+    saved_files = {rendition.file.name for rendition in created_renditions}
+    for obj in bulk_objs:
+        if obj.file.name not in saved_files:
+            obj.file.delete(save=False)
+
+    return existing_renditions + created_renditions
+
+
+# Images looked up per query by get_renditions_for_images.
+LOOKUP_CHUNK_SIZE = 200
+
+
+def get_renditions_for_images(images, filters, generate=True):
+    """
+    Like image_get_renditions, for several images at once: all images are looked up with a single
+    cache round-trip and a query per LOOKUP_CHUNK_SIZE images, and the missing renditions of each image generated in one batch.
+    The renditions are attached to the images, so later lookups on the same instances, e.g. by the tags,
+    don’t query again. Images whose source file is missing are skipped, and get None renditions.
+
+    :param images: list of AbstractImage, of the same model
+    :param filters: list of Filter or str filter specifications, or a function returning them for an image
+    :param generate: with False, missing renditions are returned as None
+    :return: list of lists of renditions, in the order of the images and filters
+    """
+    images = list(images)
+    if len(images) == 0:
+        return []
+    Rendition = images[0].get_rendition_model()
+
+    # Per image, list of (Filter, focal point cache key, rendition cache key).
+    images_params = []
+    for image in images:
+        image_filters = filters(image) if callable(filters) else filters
+        image_filters = [Filter(spec=f) if isinstance(f, str) else f for f in image_filters]
+        params = []
+        for filter in image_filters:
+            cache_key = filter.get_cache_key(image)
+            params.append((filter, cache_key, Rendition.construct_cache_key(image.id, cache_key, filter.spec)))
+        images_params.append(params)
+
+    try:
+        rendition_caching = True
+        cache = caches['renditions']
+        renditions = cache.get_many(list({key for params in images_params for filter, cache_key, key in params}))
+    except InvalidCacheBackendError:
+        rendition_caching = False
+        renditions = {}
+    tiers = [{filter.spec: 'cache' for filter, cache_key, key in params if key in renditions} for params in images_params]
 
-    return renditions
+    # One IN list of image ids and filter specs per focal point key, as in get_renditions_q.
+    # Images with a focal point each have their own key, so images are looked up in chunks
+    # to keep the number of terms below the expression depth limit of SQLite.
+    queries = []
+    for i in range(0, len(images), LOOKUP_CHUNK_SIZE):
+        lookups = {}
+        for image, params in zip(images[i:i + LOOKUP_CHUNK_SIZE], images_params[i:i + LOOKUP_CHUNK_SIZE]):
+            for filter, cache_key, key in params:
+                if key not in renditions:
+                    image_ids, specs = lookups.setdefault(cache_key, (set(), set()))
+                    image_ids.add(image.pk)
+                    specs.add(filter.spec)
+        if len(lookups) > 0:
+            q_objects = Q()
+            for cache_key, (image_ids, specs) in lookups.items():
+                q_objects |= Q(image_id__in=sorted(image_ids), focal_point_key=cache_key, filter_spec__in=sorted(specs))
+            queries.append(q_objects)
+
+    if len(queries) > 0:
+        fetched_renditions = {
+            Rendition.construct_cache_key(rendition.image_id, rendition.focal_point_key, rendition.filter_spec): rendition
+            for q_objects in queries
+            for rendition in with_file_sizes(Rendition.objects.filter(q_objects))
+        }
+        fill_file_sizes(fetched_renditions.values())
+
+        for image, params, image_tiers in zip(images, images_params, tiers):
+            missing_rendition_params = {}
+            for filter, cache_key, key in params:
+                if key in renditions:
+                    continue
+                if key in fetched_renditions:
+                    image_tiers[filter.spec] = 'db'
+                else:
+                    missing_rendition_params[key] = (filter, cache_key)
+                    image_tiers[filter.spec] = None
+            if generate and len(missing_rendition_params) > 0:
+                try:
+                    created_renditions = create_renditions(image, list(missing_rendition_params.values()))
+                except SourceImageIOError:
+                    continue
+                for rendition in created_renditions:
+                    fetched_renditions[Rendition.construct_cache_key(image.id, rendition.focal_point_key, rendition.filter_spec)] = rendition
+                    image_tiers[rendition.filter_spec] = 'generated'
+
+        needed_keys = {key for params in images_params for filter, cache_key, key in params}
+        fetched_renditions = {key: rendition for key, rendition in fetched_renditions.items() if key in needed_keys}
+        if rendition_caching:
+            cache.set_many(fetched_renditions)
+        renditions.update(fetched_renditions)
+
+    results = []
+    for image, params, image_tiers in zip(images, images_params, tiers):
+        image_renditions = {key: renditions[key] for filter, cache_key, key in params if key in renditions}
+        if not hasattr(image, '_prefetched_renditions'):
+            image._prefetched_renditions = {}
+        image._prefetched_renditions.update(image_renditions)
+        if renditions_served.has_listeners():
+            send_renditions_served(image, image_tiers)
+        results.append([image_renditions.get(key) for filter, cache_key, key in params])
+    return results
+
+
+def send_renditions_served(image, tiers):
+    renditions_served.send(sender=image.__class__, image=image, tiers=tiers)
 
 
 def get_renditions_or_not_found(image, specs):
@@ -114,7 +426,94 @@ def get_renditions_or_not_found(image, specs):
         # Image file is (probably) missing from /media/original_images - generate a dummy
         # rendition so that we just output a broken image, rather than crashing out completely
         # during rendering.
-        Rendition = image.renditions.model  # pick up any custom Image / Rendition classes that may be in use
-        rendition = Rendition(image=image, width=0, height=0)
-        rendition.file.name = 'not-found'
+        rendition = get_not_found_rendition(image)
         return [rendition for spec in specs]
+
+
+def get_not_found_rendition(image):
+    Rendition = image.renditions.model  # pick up any custom Image / Rendition classes that may be in use
+    rendition = Rendition(image=image, width=0, height=0)
+    rendition.file.name = 'not-found'
+    return rendition
+
+
+def image_get_rendition_records(image, filters):
+    """
+    Like image_get_renditions, but returning compact RenditionRecord objects,
+    served from an in-process LRU cache in front of the shared cache and the database.
+    In background mode, missing renditions are queued for generation and placeholder records returned instead.
+    With manifests enabled, the records of all filters are read and stored together on LRU misses.
+    """
+    filters = [Filter(spec=f) if isinstance(f, str) else f for f in filters]
+    Rendition = image.get_rendition_model()
+    rendition_cache_keys = [
+        Rendition.construct_cache_key(image.id, filter.get_cache_key(image), filter.spec)
+        for filter in filters
+    ]
+
+    lru = get_rendition_lru()
+    records = lru.get_many(rendition_cache_keys) if lru is not None else {}
+    if renditions_served.has_listeners() and len(records) > 0:
+        send_renditions_served(image, {
+            filter.spec: 'lru' for filter, rendition_cache_key in zip(filters, rendition_cache_keys)
+            if rendition_cache_key in records
+        })
+    if len(records) == len(rendition_cache_keys):
+        return [records[rendition_cache_key] for rendition_cache_key in rendition_cache_keys]
+
+    # Images from get_renditions_for_images already have their renditions, without further queries.
+    # Manifests are only built from records fetched in this call: LRU records can be stale
+    # in other processes, and would be served from the manifest everywhere.
+    use_manifest = get_manifests_enabled() and not hasattr(image, '_prefetched_renditions') and len(records) == 0
+    if use_manifest:
+        manifest_records = get_manifest(image, filters)
+        if manifest_records is not None:
+            if lru is not None:
+                lru.set_many(dict(zip(rendition_cache_keys, manifest_records)))
+            if renditions_served.has_listeners():
+                send_renditions_served(image, {filter.spec: 'manifest' for filter in filters})
+            return manifest_records
+
+    missing = [
+        (filter, rendition_cache_key) for filter, rendition_cache_key in zip(filters, rendition_cache_keys)
+        if rendition_cache_key not in records
+    ]
+    generate = get_background_mode() is None
+    renditions = image_get_renditions(image, [filter for filter, rendition_cache_key in missing], generate=generate)
+    fetched_records = {
+        rendition_cache_key: RenditionRecord.from_rendition(rendition)
+        for (filter, rendition_cache_key), rendition in zip(missing, renditions)
+        if rendition is not None
+    }
+    if lru is not None:
+        lru.set_many(fetched_records)
+    records.update(fetched_records)
+
+    pending = [params for params, rendition in zip(missing, renditions) if rendition is None]
+    if len(pending) > 0:
+        enqueue_renditions(image, [filter for filter, rendition_cache_key in pending])
+        existing_records = list(records.values())
+        for filter, rendition_cache_key in pending:
+            records[rendition_cache_key] = get_placeholder_record(image, filter, existing_records)
+        if renditions_served.has_listeners():
+            send_renditions_served(image, {filter.spec: 'pending' for filter, rendition_cache_key in pending})
+
+    records = [records[rendition_cache_key] for rendition_cache_key in rendition_cache_keys]
+    if use_manifest:
+        save_manifest(image, filters, records)
+    return records
+
+
+def get_rendition_records_or_not_found(image, specs):
+    """
+    Like get_renditions_or_not_found, but returning RenditionRecord objects.
+
+    :param image: AbstractImage
+    :param specs: list of str filter specifications
+    :return: list of RenditionRecord
+    """
+    try:
+        return image_get_rendition_records(image, specs)
+    except SourceImageIOError:
+        record = RenditionRecord.from_rendition(get_not_found_rendition(image))
+        return [record for spec in specs]
@@ -0,0 +1,60 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from wagtail.images import get_image_model
+
+from wagtail_picture_proposal.cache import get_rendition_lru, invalidate_fragments
+from wagtail_picture_proposal.cleanup import purge_image_caches
+from wagtail_picture_proposal.manifests import invalidate_manifests
+
+
+def invalidate_image_fragments(instance, **kwargs):
+    # Covers changes to the image file and focal point.
+    invalidate_fragments(instance.pk)
+
+
+def purge_image_renditions(instance, created=False, **kwargs):
+    # Renditions of a previous file or focal point would otherwise stay in the caches until they expire.
+    # Connected to pre_delete, as the renditions can’t be listed anymore after.
+    if not created:
+        purge_image_caches(instance)
+
+
+def purge_rendition_lru(instance, **kwargs):
+    # Wagtail purges the renditions cache, but deleted renditions would stay in the LRU until they expire.
+    lru = get_rendition_lru()
+    if lru is not None:
+        lru.delete_many([instance.construct_cache_key(instance.image_id, instance.focal_point_key, instance.filter_spec)])
+
+
+def invalidate_rendition_fragments(instance, **kwargs):
+    invalidate_fragments(instance.image_id)
+
+
+def delete_rendition_file_size(instance, **kwargs):
+    from wagtail_picture_proposal.models import RenditionFileSize
+
+    RenditionFileSize.objects.filter(
+        image_id=instance.image_id,
+        filter_spec=instance.filter_spec,
+        focal_point_key=instance.focal_point_key,
+    ).delete()
+
+
+def invalidate_rendition_manifests(instance, **kwargs):
+    invalidate_manifests(instance.image_id, [(instance.filter_spec, instance.focal_point_key)])
+
+
+def register_signal_handlers():
+    Image = get_image_model()
+    Rendition = Image.get_rendition_model()
+
+    post_save.connect(invalidate_image_fragments, sender=Image)
+    post_delete.connect(invalidate_image_fragments, sender=Image)
+    post_save.connect(purge_image_renditions, sender=Image)
+    pre_delete.connect(purge_image_renditions, sender=Image)
+    post_save.connect(invalidate_rendition_fragments, sender=Rendition)
+    post_delete.connect(invalidate_rendition_fragments, sender=Rendition)
+    post_delete.connect(delete_rendition_file_size, sender=Rendition)
+    post_delete.connect(purge_rendition_lru, sender=Rendition)
+    post_save.connect(invalidate_rendition_manifests, sender=Rendition)
+    post_delete.connect(invalidate_rendition_manifests, sender=Rendition)
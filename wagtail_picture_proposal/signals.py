@@ -0,0 +1,17 @@
+from django.dispatch import Signal
+
+
+# Instrumentation of the rendition hot path, e.g. for the debug toolbar panel.
+# Only sent when there are receivers.
+
+# Sent when renditions of an image are served, with `image` and `tiers`:
+# a dict of filter spec to the tier which served it,
+# "fragment", "manifest", "lru", "prefetch", "cache", "db", "single-flight", "generated", "pending", or None if missing.
+renditions_served = Signal()
+
+# Sent once renditions of an image are generated, with `image`, `duration` (seconds for the whole batch,
+# including decoding the source image) and `renditions`: list of (filter spec, format, bytes, encode seconds).
+renditions_generated = Signal()
+
+# Sent after a picture tag is rendered, with `node` and `duration` (seconds).
+tag_rendered = Signal()
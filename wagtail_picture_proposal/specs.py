@@ -0,0 +1,96 @@
+import itertools
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from wagtail.images.models import Filter
+
+
+brace_pattern = re.compile(r"{([^{}]*)}")
+range_pattern = re.compile(r"^(\d+)\.\.(\d+)(?::(\d+))?$")
+
+
+def expand_brace_group(group):
+    """
+    Expand the contents of a single brace group.
+    Examples: "1600x900,800x450" → ["1600x900", "800x450"], "320..1280:160" → ["320", "480", …, "1280"].
+    """
+    values = []
+    for item in group.split(','):
+        match = range_pattern.match(item)
+        if match:
+            start, stop = int(match.group(1)), int(match.group(2))
+            step = int(match.group(3) or 1)
+            if step == 0:
+                raise ValueError(f"range step must be greater than 0, got {item!r}")
+            if start > stop:
+                step = -step
+            values.extend(str(value) for value in range(start, stop + (1 if step > 0 else -1), step))
+        else:
+            values.append(item)
+    return values
+
+
+def expand_braces(raw_filter):
+    """
+    Expand all brace groups within a filter spec, combining them when there are several.
+    Example: fill-{1600x900,800x450}-c{80,100} → fill-1600x900-c80, fill-1600x900-c100, fill-800x450-c80, …
+    """
+    parts = brace_pattern.split(raw_filter)
+    if any('{' in part or '}' in part for part in parts[::2]):
+        raise ValueError(f"unbalanced braces in filter {raw_filter!r}")
+
+    choices = [[part] if i % 2 == 0 else expand_brace_group(part) for i, part in enumerate(parts)]
+    return [''.join(choice) for choice in itertools.product(*choices)]
+
+
+@lru_cache(maxsize=1000)
+def compile_filter_specs(raw_specs):
+    """
+    Turn the specs given to a tag into the list of filter specs to generate renditions for.
+    Space-separated specs are concatenated, while brace-expanded ones generate multiple renditions at once.
+
+    :param raw_specs: tuple of str, as written in the template or resolved from context variables
+    :return: tuple of str filter specs
+    """
+    # Space-separated filters, to be concatenated.
+    spaced_filters = []
+    # Brace-expanded filters, to generate multiple renditions at once.
+    braced_filters = []
+
+    named_filters = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_NAMED_FILTERS', {})
+
+    for raw_filter in raw_specs:
+        # TODO If the filter matches one of the predefined named filters.
+        # Do we want those to be expanded as well?
+        raw_filter = named_filters.get(raw_filter, raw_filter)
+        if "{" in raw_filter or "}" in raw_filter:
+            braced_filters.append(expand_braces(raw_filter))
+        else:
+            spaced_filters.append(raw_filter)
+
+    return tuple('|'.join((*braced, *spaced_filters)) for braced in itertools.product(*braced_filters))
+
+
+@lru_cache(maxsize=1000)
+def compile_filters(specs):
+    """
+    Build ready-to-use Filter objects for the given specs, with their operations already parsed.
+
+    :param specs: tuple of str filter specs
+    :return: tuple of Filter
+    """
+    filters = tuple(Filter(spec=spec) for spec in specs)
+    for filter in filters:
+        # Parse operations now, which also validates the spec.
+        filter.operations
+    return filters
+
+
+@receiver(setting_changed)
+def clear_compiled_specs(*, setting, **kwargs):
+    if setting == 'WAGTAIL_PICTURE_PROPOSAL_NAMED_FILTERS':
+        compile_filter_specs.cache_clear()
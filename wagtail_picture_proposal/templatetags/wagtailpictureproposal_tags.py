@@ -1,19 +1,31 @@
 import re
+import time
+from functools import lru_cache
 
 from django import template
-from django.conf import settings
 from django.template.base import FilterExpression
 from django.template.loader import render_to_string
 
-from wagtail.images.models import Filter
+from wagtail.images.exceptions import InvalidFilterSpecError
 
-from wagtail_picture_proposal.shortcuts import get_renditions_or_not_found
+from wagtail_picture_proposal.batching import get_current_batch
+from wagtail_picture_proposal.breakpoints import expand_breakpoints, sample_specs
+from wagtail_picture_proposal.cache import (
+    RenditionRecord,
+    get_file_format,
+    get_fragment_cache,
+    get_fragment_key,
+    get_fragment_timeout,
+)
+from wagtail_picture_proposal.shortcuts import get_rendition_records_or_not_found, get_renditions_or_not_found
+from wagtail_picture_proposal.signals import renditions_served, tag_rendered
+from wagtail_picture_proposal.specs import compile_filter_specs, compile_filters
 
 
 register = template.Library()
 # TODO–DONE Update to add the extra syntax needed.
 # allowed_filter_pattern = re.compile(r"^[A-Za-z0-9_\-\.]+$")
-allowed_filter_pattern = re.compile(r"^[A-Za-z0-9_\-\.{},]+$")
+allowed_filter_pattern = re.compile(r"^[A-Za-z0-9_\-\.{},:\[\]=]+$")
 
 
 @register.tag(name="img_srcset_wip")
@@ -39,6 +51,9 @@ def img_srcset_wip(parser, token):
             else:
                 # more than one item exists after 'as' - reject as invalid
                 is_valid = False
+        elif '[' in bit and allowed_filter_pattern.match(bit):
+            # e.g. width-auto[320..1600,step=20kb], not an attribute despite the "=".
+            filter_specs.append(bit)
         else:
             try:
                 name, value = bit.split('=')
@@ -54,7 +69,7 @@ def img_srcset_wip(parser, token):
                     else:
                         # TODO-DONE Update error message.
                         raise template.TemplateSyntaxError(
-                            "filter specs in 'picture_wip' tag may only contain A-Z, a-z, 0-9, dots, hyphens, curly braces, and underscores. "
+                            "filter specs in 'picture_wip' tag may only contain A-Z, a-z, 0-9, dots, colons, commas, hyphens, curly braces, square brackets, equals signs, and underscores. "
                             "(given filter: {})".format(bit)
                         )
 
@@ -97,44 +112,35 @@ class ImgSrcsetNode(template.Node):
         self.attrs = attrs or {}
         self.filter_specs = filter_specs
 
-    def raw_filter_specs(self, context):
-        # Space-separated filters, to be concatenated.
-        spaced_filters = []
-        # Brace-expanded filters, to generate multiple renditions at once.
-        braced_filters = []
-
-        named_filters = getattr(settings, 'WAGTAIL_PICTURE_PROPOSAL_NAMED_FILTERS', {})
-
-        for spec in self.filter_specs:
-            raw_filter = spec.resolve(context) if isinstance(spec, FilterExpression) else spec
-            # TODO If the filter matches one of the predefined named filters.
-            # Do we want those to be expanded as well?
-            raw_filter = named_filters.get(raw_filter, raw_filter)
-            if "{" in raw_filter:
-                if len(braced_filters) > 0:
-                    raise ValueError(f"{self.tag_name} tag supports at most one pattern with brace-expansion, got {braced_filters:r} and {raw_filter:r}")
-
-                # Example: fill-{1600x900,800x450}-c80
-                split_filter = raw_filter.split('{')
-                filter_prefix, repeat_pattern_suffixed = split_filter
-
-                if len(split_filter) > 2:
-                    raise ValueError(f"{self.tag_name} tag expected at most one brace-expansion pattern in the filter, got {len(split_filter) - 1} in {raw_filter:r}")
-
-                repeat_pattern, filter_suffix = repeat_pattern_suffixed.split('}')
-                repeats = repeat_pattern.split(',')
-                braced_filters = [f"{filter_prefix}{repeat}{filter_suffix}" for repeat in repeats]
-            else:
-                spaced_filters.append(raw_filter)
+        # When all specs are literals, compile them once at parse time.
+        self.compiled_filter_specs = None
+        if not any(isinstance(spec, FilterExpression) for spec in filter_specs):
+            try:
+                self.compiled_filter_specs = compile_filter_specs(tuple(filter_specs))
+                compile_filters(sample_specs(self.compiled_filter_specs))
+            except (ValueError, InvalidFilterSpecError) as e:
+                raise template.TemplateSyntaxError(f"{self.tag_name} tag: {e}")
 
-        if braced_filters:
-            raw_combined_filters = ['|'.join((f, *spaced_filters)) for f in braced_filters]
-        else:
-            raw_combined_filters = ['|'.join(spaced_filters)]
+    def raw_filter_specs(self, context):
+        if self.compiled_filter_specs is not None:
+            return self.compiled_filter_specs
 
-        return raw_combined_filters
+        # Compiled specs are memoized, keyed by the resolved strings.
+        return compile_filter_specs(tuple(
+            spec.resolve(context) if isinstance(spec, FilterExpression) else spec
+            for spec in self.filter_specs
+        ))
 
     def render(self, context):
+        if not tag_rendered.has_listeners():
+            return self.render_tag(context)
+
+        start = time.perf_counter()
+        output = self.render_tag(context)
+        tag_rendered.send(sender=self.__class__, node=self, duration=time.perf_counter() - start)
+        return output
+
+    def render_tag(self, context):
         try:
             image = self.image_expr.resolve(context)
         except template.VariableDoesNotExist:
@@ -148,12 +154,11 @@ class ImgSrcsetNode(template.Node):
         if not hasattr(image, 'get_rendition'):
             raise ValueError(f"{self.tag_name} tag expected an Image object, got {image!r}")
 
-        filters = [Filter(spec=f) for f in self.raw_filter_specs(context)]
-        renditions = get_renditions_or_not_found(image, filters)
+        filters = compile_filters(expand_breakpoints(image, self.raw_filter_specs(context)))
 
         if self.output_var_name:
-            # return the rendition object in the given variable
-            context[self.output_var_name] = renditions
+            # return the rendition objects in the given variable, as models so all their attributes are available
+            context[self.output_var_name] = get_renditions_or_not_found(image, filters)
             return ''
         else:
             # render the rendition's image tag now
@@ -161,10 +166,45 @@ class ImgSrcsetNode(template.Node):
             for key in self.attrs:
                 resolved_attrs[key] = self.attrs[key].resolve(context)
 
-            return render_to_string('img_srcset_wip.html', {
+            return self.render_cached(image, filters, resolved_attrs, lambda renditions: render_to_string('img_srcset_wip.html', {
                 "fallback_renditions": renditions,
                 "attributes": resolved_attrs
-            })
+            }))
+
+    def render_cached(self, image, filters, resolved_attrs, render_html):
+        return render_cached(self.tag_name, image, filters, resolved_attrs, render_html)
+
+
+def render_cached(tag_name, image, filters, resolved_attrs, render_html):
+    """
+    Serve the tag’s HTML from the fragment cache if enabled,
+    rendering it with `render_html(renditions)` on a miss.
+    Under TagBatchingMiddleware, returns a placeholder, and the HTML is rendered once the whole response is.
+    """
+    batch = get_current_batch()
+    if batch is not None:
+        return batch.add(image, filters, lambda: render_fragment(tag_name, image, filters, resolved_attrs, render_html))
+    return render_fragment(tag_name, image, filters, resolved_attrs, render_html)
+
+
+def render_fragment(tag_name, image, filters, resolved_attrs, render_html):
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return render_html(get_rendition_records_or_not_found(image, filters))
+
+    fragment_key = get_fragment_key(fragment_cache, image, tag_name, filters, resolved_attrs)
+    html = fragment_cache.get(fragment_key)
+    if html is None:
+        renditions = get_rendition_records_or_not_found(image, filters)
+        html = render_html(renditions)
+        # Markup with placeholders is only cached once the renditions have been generated.
+        if not any(rendition.placeholder for rendition in renditions):
+            fragment_cache.set(fragment_key, html, get_fragment_timeout())
+    elif renditions_served.has_listeners():
+        renditions_served.send(
+            sender=image.__class__, image=image, tiers={filter.spec: 'fragment' for filter in filters}
+        )
+    return html
 
 
 @register.tag(name="webp_picture_wip")
@@ -216,6 +256,9 @@ def webp_picture_wip(parser, token):
             else:
                 # more than one item exists after 'as' - reject as invalid
                 is_valid = False
+        elif '[' in bit and allowed_filter_pattern.match(bit):
+            # e.g. width-auto[320..1600,step=20kb], not an attribute despite the "=".
+            filter_specs.append(bit)
         else:
             try:
                 name, value = bit.split('=')
@@ -231,7 +274,7 @@ def webp_picture_wip(parser, token):
                     else:
                         # TODO-DONE Update error message.
                         raise template.TemplateSyntaxError(
-                            "filter specs in 'webp_picture_wip' tag may only contain A-Z, a-z, 0-9, dots, hyphens, curly braces, and underscores. "
+                            "filter specs in 'webp_picture_wip' tag may only contain A-Z, a-z, 0-9, dots, colons, commas, hyphens, curly braces, square brackets, equals signs, and underscores. "
                             "(given filter: {})".format(bit)
                         )
 
@@ -265,78 +308,113 @@ def webp_picture_wip(parser, token):
         )
 
 
-class WebPPictureNode(ImgSrcsetNode):
-    def __init__(self, image_expr, filter_specs, output_var_name=None, attrs=None):
-        # TODO Should be None, no default quality.
-        self.quality = 100
-        self.specified_format = None
-        for i, spec in enumerate(filter_specs):
-            if spec.startswith("q-") or spec.startswith("quality-"):
-                self.quality = filter_specs.pop(i).split("-")[-1]
-            if spec.startswith("format-"):
-                self.specified_format = filter_specs.pop(i).split("-")[-1]
+def fallback_filter_specs(source_spec_list, native_format, specified_format=None, quality=None):
+    """
+    TODO Update docs
+    Return the filter specs to use for creating <img> tag renditions. These will
+    serve as our IE11/Safari fallback, so need to be
+    a png, jpeg or gif (not webp).
+    By default, webp images are converted to png in order
+    to preserve transparency. Add 'format-jpeg' to convert
+    to jpegs instead.
+    """
+    target_format = None
+    appended_specs = []
+    if specified_format:
+        target_format = specified_format
+        if target_format in ("webp", "webp-lossless"):
+            target_format = "png"
+    elif native_format == "webp":
+        target_format = "png"
+    if target_format:
+        appended_specs.append(f"format-{target_format}")
 
-        super().__init__(image_expr, filter_specs, output_var_name, attrs or {})
+    if target_format == "jpeg" or native_format == "jpeg":
+        if "jpegquality-" not in source_spec_list[0]:
+            appended_specs.append(f"jpegquality-{quality}")
 
-    def extract_native_format(self, image):
-        ext = image.file.name.lower().split(".").pop()
-        if ext in ("jpg", "jpeg"):
-            return "jpeg"
-        return ext
-
-    def fallback_filter_specs(self, source_spec_list):
-        """
-        TODO Update docs
-        Return a ``wagtail.images.models.Filter`` instance
-        to use for creating <img> tag rendition. This will
-        serve as our IE11/Safari fallback, so needs to be
-        a png, jpeg or gif (not webp).
-        By default, webp images are converted to png in order
-        to preserve transparency. Add 'format-jpeg' to convert
-        to jpegs instead.
-        """
-        target_format = None
-        appended_specs = []
-        if self.specified_format:
-            target_format = self.specified_format
-            if target_format in ("webp", "webp-lossless"):
-                target_format = "png"
-        elif self.native_format == "webp":
-            target_format = "png"
-        if target_format:
-            appended_specs.append(f"format-{target_format}")
-
-        if target_format == "jpeg" or self.native_format == "jpeg":
-            if "jpegquality-" not in source_spec_list[0]:
-                appended_specs.append(f"jpegquality-{self.quality}")
-
-        if len(appended_specs) == 0:
-            return source_spec_list
-
-        return [f"{s}|{'|'.join(appended_specs)}" for s in source_spec_list]
-
-    def webp_filter_specs(self, source_spec_list):
-        """
-        TODO update docs
-        Return a ``wagtail.images.models.Filter`` instance
-        to use for webp ``source`` rendition.
-        By default, lossy webp renditions are created, but
-        you can add 'q-100' or 'quality-100' to use
-        webp-lossless.
-        """
-        target_format = "webp"
-        appended_specs = []
-        if self.quality:
-            if self.quality == "100":
-                target_format = "webp-lossless"
-            elif "webpquality-" not in source_spec_list[0]:
-                appended_specs.append(f"webpquality-{self.quality}")
+    if len(appended_specs) == 0:
+        return source_spec_list
 
-        appended_specs.append(f"format-{target_format}")
+    return [f"{s}|{'|'.join(appended_specs)}" for s in source_spec_list]
 
-        return [f"{s}|{'|'.join(appended_specs)}" for s in source_spec_list]
 
-    def render(self, context):
+def webp_filter_specs(source_spec_list, quality=None):
+    """
+    TODO update docs
+    Return the filter specs to use for webp ``source`` renditions.
+    By default, lossy webp renditions are created, but
+    you can add 'q-100' or 'quality-100' to use
+    webp-lossless.
+    """
+    target_format = "webp"
+    appended_specs = []
+    if quality:
+        if quality == "100":
+            target_format = "webp-lossless"
+        elif "webpquality-" not in source_spec_list[0]:
+            appended_specs.append(f"webpquality-{quality}")
+
+    appended_specs.append(f"format-{target_format}")
+
+    return [f"{s}|{'|'.join(appended_specs)}" for s in source_spec_list]
+
+
+def parse_picture_options(filter_specs):
+    """
+    Separate the ``q-`` / ``quality-`` and ``format-`` options of a picture from its filter specs.
+
+    :return: (source filter specs, specified format, quality)
+    """
+    # TODO Should be None, no default quality.
+    quality = 100
+    specified_format = None
+    source_filter_specs = []
+    for spec in filter_specs:
+        if isinstance(spec, FilterExpression):
+            source_filter_specs.append(spec)
+        elif spec.startswith("q-") or spec.startswith("quality-"):
+            quality = spec.split("-")[-1]
+        elif spec.startswith("format-"):
+            specified_format = spec.split("-")[-1]
+        else:
+            source_filter_specs.append(spec)
+    return source_filter_specs, specified_format, quality
+
+
+def extract_native_format(image):
+    ext = image.file.name.lower().split(".").pop()
+    if ext in ("jpg", "jpeg"):
+        return "jpeg"
+    return ext
+
+
+@lru_cache(maxsize=1000)
+def compile_picture_filters(source_filter_specs, native_format, specified_format, quality):
+    """
+    Fallback and WebP filters of a picture, for a source image in the given format.
+    Memoized by value, so nodes don’t hold any state and can be shared between threads.
+    """
+    fallback_specs = fallback_filter_specs(source_filter_specs, native_format, specified_format, quality)
+    webp_specs = webp_filter_specs(source_filter_specs, quality)
+    return compile_filters(tuple(fallback_specs) + tuple(webp_specs))
+
+
+class WebPPictureNode(ImgSrcsetNode):
+    """
+    Holds no per-render state: the node can be cached by the template loader and rendered concurrently.
+    """
+
+    tag_name = 'webp_picture_wip'
+
+    def __init__(self, image_expr, filter_specs, output_var_name=None, attrs=None):
+        source_filter_specs, self.specified_format, self.quality = parse_picture_options(filter_specs)
+        super().__init__(image_expr, source_filter_specs, output_var_name, attrs or {})
+
+    def extract_native_format(self, image):
+        return extract_native_format(image)
+
+    def render_tag(self, context):
         try:
             image = self.image_expr.resolve(context)
         except template.VariableDoesNotExist:
@@ -347,52 +425,83 @@ class WebPPictureNode(ImgSrcsetNode):
                 context[self.output_var_name] = None
             return ''
 
-        self.native_format = self.extract_native_format(image)
-
         if not hasattr(image, 'get_rendition'):
             raise ValueError("webp_picture_wip tag expected an Image object, got %r" % image)
 
-        source_filter_specs = self.raw_filter_specs(context)
-        fallback_specs = self.fallback_filter_specs(source_filter_specs)
-        webp_specs = self.webp_filter_specs(source_filter_specs)
-        filter_specs = [] + fallback_specs + webp_specs
-        filters = [Filter(spec=f) for f in filter_specs]
-        renditions = get_renditions_or_not_found(image, filters)
-
-        webp_renditions = []
-        fallback_renditions = []
-
-        for r in renditions:
-            if self.extract_native_format(r) == "webp":
-                webp_renditions.append(r)
-            else:
-                fallback_renditions.append(r)
-
-        output_context = {
-            "webp_source": webp_renditions,
-            "fallback_source": fallback_renditions,
-            "fallback": fallback_renditions[0],
-            "fallback_mime": f"image/{self.extract_native_format(fallback_renditions[0])}"
-        }
+        filters = compile_picture_filters(
+            expand_breakpoints(image, self.raw_filter_specs(context)),
+            self.extract_native_format(image),
+            self.specified_format,
+            self.quality,
+        )
 
         if self.output_var_name:
             # return the rendition object in the given variable
-            context[self.output_var_name] = output_context
+            context[self.output_var_name] = self.get_output_context(get_renditions_or_not_found(image, filters))
             return ''
 
         # render the rendition's image tag now
         resolved_attrs = {}
-        sizes = None
         for key in self.attrs:
-            value = self.attrs[key].resolve(context)
-            if key == "sizes":
-                sizes = value
-            else:
-                resolved_attrs[key] = value
+            resolved_attrs[key] = self.attrs[key].resolve(context)
+
+        return self.render_cached(image, filters, resolved_attrs, lambda renditions: render_to_string('webp_picture_wip.html', {
+            **self.get_output_context(renditions),
+            "attributes": {key: value for key, value in resolved_attrs.items() if key != "sizes"},
+            "sizes": resolved_attrs.get("sizes"),
+        }))
+
+    def get_output_context(self, renditions):
+        return get_picture_context(renditions)
+
+
+def get_picture_context(renditions):
+    """
+    Split the renditions of a picture between its WebP and fallback sources.
+
+    :param renditions: list of RenditionRecord, or of Rendition for the ``as`` form
+    """
+    webp_renditions = []
+    fallback_renditions = []
+
+    for r in renditions:
+        if get_rendition_format(r) == "webp":
+            webp_renditions.append(r)
+        else:
+            fallback_renditions.append(r)
+
+    # Fallback and WebP renditions come in the same order, from the same source specs.
+    larger_webp = any(smaller_file(fallback, webp) for fallback, webp in zip(fallback_renditions, webp_renditions))
+
+    return {
+        "webp_source": webp_renditions,
+        # Decided for the whole picture: if any WebP rendition is larger than its fallback, the markup leaves out
+        # the WebP source entirely, rather than the widths where it is larger, so browsers supporting WebP
+        # don't pick another width from the gaps. Otherwise it lists every width.
+        "use_webp_source": not larger_webp,
+        "fallback_source": fallback_renditions,
+        "fallback": fallback_renditions[0],
+        "fallback_mime": f"image/{get_rendition_format(fallback_renditions[0])}"
+    }
+
+
+def get_rendition_format(rendition):
+    if isinstance(rendition, RenditionRecord):
+        return rendition.format
+    return get_file_format(rendition.file.name)
 
-        return render_to_string('webp_picture_wip.html', {
-            **output_context,
-            "attributes": resolved_attrs,
-            "sizes": sizes,
-        })
 
+def get_rendition_file_size(rendition):
+    if isinstance(rendition, RenditionRecord):
+        # Records cached by earlier versions have no file size.
+        return getattr(rendition, 'file_size', None)
+    return getattr(rendition, 'picture_file_size', None)
+
+
+def smaller_file(rendition, other):
+    """
+    Whether the file of ``rendition`` is known to be smaller than the other’s.
+    """
+    size = get_rendition_file_size(rendition)
+    other_size = get_rendition_file_size(other)
+    return size is not None and other_size is not None and size < other_size
@@ -1,5 +1,6 @@
+from functools import lru_cache
+
 from django import template
-from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.utils.html import format_html
 from wagtail.images.models import Filter
@@ -50,81 +51,114 @@ def webp_picture(parser, token):
     )
 
 
+@lru_cache(maxsize=1000)
+def get_fallback_filter(filter_spec, native_format, specified_format=None, quality=None):
+    """
+    Return a ``wagtail.images.models.Filter`` instance
+    to use for creating <img> tag rendition. This will
+    serve as our IE11/Safari fallback, so needs to be
+    a png, jpeg or gif (not webp).
+    By default, webp images are convered to png in order
+    to preserve transparency. Add 'format-jpeg' to convert
+    to jpegs instead.
+    """
+    target_format = None
+    spec_list = filter_spec.split("|")
+    if specified_format:
+        target_format = specified_format
+        if target_format in ("webp", "webp-lossless"):
+            target_format = "png"
+    elif native_format == "webp":
+        target_format = "png"
+    if target_format:
+        spec_list.append(f"format-{target_format}")
+    if target_format == "jpeg":
+        if "jpegquality-" not in filter_spec:
+            spec_list.append(f"jpegquality-{quality}")
+    return Filter("|".join(spec_list))
+
+
+@lru_cache(maxsize=1000)
+def get_webp_filter(filter_spec, quality=None):
+    """
+    Return a ``wagtail.images.models.Filter`` instance
+    to use for webp ``source`` rendition.
+    By default, lossy webp renditions are created, but
+    you can add 'q-100' or 'quality-100' to use
+    webp-lossless.
+    """
+    target_format = "webp"
+    spec_list = filter_spec.split("|")
+    if quality:
+        if quality == "100":
+            target_format = "webp-lossless"
+        elif "webpquality-" not in filter_spec:
+            spec_list.append(f"webpquality-{quality}")
+    spec_list.append(f"format-{target_format}")
+    return Filter("|".join(spec_list))
+
+
 class WebPImageNode(ImageNode):
+    """
+    Holds no per-render state: filters depending on the image are looked up for each render,
+    so the node can be cached by the template loader and rendered concurrently.
+    """
+
     def __init__(self, image_expr, filter_spec, output_var_name=None, attrs=None):
         self.quality = None
         self.specified_format = None
-        spec_list = filter_spec.split("|")
-        for i, spec in enumerate(spec_list):
+        spec_list = []
+        for spec in filter_spec.split("|"):
             if spec.startswith("q-") or spec.startswith("quality-"):
-                self.quality = spec_list.pop(i).split("-").pop()
-            if spec.startswith("format-"):
-                self.specified_format = spec_list.pop(i).split("-").pop()
+                self.quality = spec.split("-").pop()
+            elif spec.startswith("format-"):
+                self.specified_format = spec.split("-").pop()
+            else:
+                spec_list.append(spec)
         super().__init__(image_expr, "|".join(spec_list), output_var_name, attrs or {})
 
     def extract_native_format(self, image):
         ext = image.file.name.lower().split(".").pop()
         if ext in ("jpg", "jpeg"):
-            self.native_format = "jpeg"
-        else:
-            # Should be png, gif or webp
-            self.native_format = ext
-
-    @cached_property
-    def filter(self):
-        """
-        Return a ``wagtail.images.models.Filter`` instance
-        to use for creating <img> tag rendition. This will
-        serve as our IE11/Safari fallback, so needs to be
-        a png, jpeg or gif (not webp).
-        By default, webp images are convered to png in order
-        to preserve transparency. Add 'format-jpeg' to convert
-        to jpegs instead.
-        """
-        target_format = None
-        spec_list = self.filter_spec.split("|")
-        if self.specified_format:
-            target_format = self.specified_format
-            if target_format in ("webp", "webp-lossless"):
-                target_format = "png"
-        elif self.native_format == "webp":
-            target_format = "png"
-        if target_format:
-            spec_list.append(f"format-{target_format}")
-        if target_format == "jpeg":
-            if "jpegquality-" not in self.filter_spec:
-                spec_list.append(f"jpegquality-{self.quality}")
-        return Filter("|".join(spec_list))
-
-    @cached_property
-    def webp_filter(self):
-        """
-        Return a ``wagtail.images.models.Filter`` instance
-        to use for webp ``source`` rendition.
-        By default, lossy webp renditions are created, but
-        you can add 'q-100' or 'quality-100' to use
-        webp-lossless.
-        """
-        target_format = "webp"
-        spec_list = self.filter_spec.split("|")
-        if self.quality:
-            if self.quality == "100":
-                target_format = "webp-lossless"
-            elif "webpquality-" not in self.filter_spec:
-                spec_list.append(f"webpquality-{self.quality}")
-        spec_list.append(f"format-{target_format}")
-        return Filter("|".join(spec_list))
+            return "jpeg"
+        # Should be png, gif or webp
+        return ext
+
+    def get_filter(self, image):
+        return get_fallback_filter(self.filter_spec, self.extract_native_format(image), self.specified_format, self.quality)
+
+    def get_webp_filter(self):
+        return get_webp_filter(self.filter_spec, self.quality)
 
     def render(self, context):
-        image = self.image_expr.resolve(context)
-        # set 'self.native_format' for 'filter()' to pick up
-        self.extract_native_format(image)
-        # generate the <img> tag using 'filter' for the rendition
-        img_tag = super().render(context)
-        if not img_tag:
-            return img_tag
+        try:
+            image = self.image_expr.resolve(context)
+        except template.VariableDoesNotExist:
+            return ''
+
+        if not image:
+            if self.output_var_name:
+                context[self.output_var_name] = None
+            return ''
+
+        if not hasattr(image, 'get_rendition'):
+            raise ValueError("webp_picture tag expected an Image object, got %r" % image)
+
+        rendition = get_rendition_or_not_found(image, self.get_filter(image))
+
+        if self.output_var_name:
+            # return the rendition object in the given variable
+            context[self.output_var_name] = rendition
+            return ''
+
+        # generate the <img> tag using the fallback rendition
+        resolved_attrs = {}
+        for key in self.attrs:
+            resolved_attrs[key] = self.attrs[key].resolve(context)
+        img_tag = rendition.img_tag(resolved_attrs)
+
         # now wrap in a <picture> tag with the webp version as a source
-        webp_rendition = get_rendition_or_not_found(image, self.webp_filter)
+        webp_rendition = get_rendition_or_not_found(image, self.get_webp_filter())
         return format_html(
             '<picture><source srcset="{}" type="image/webp">{}</picture>',
             webp_rendition.url,